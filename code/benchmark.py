@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from multiprocessing import Pool
+from sklearn.ensemble import RandomForestRegressor
+from synthetic_data import generate
+from instrumentation import peak_rss_mb
+from test_models import ModelTester
+
+FEATURE_TEXT_FILES = ["SMSLog.csv", "CallLog.csv", "Battery.csv", "BluetoothProximity.csv"]
+DEFAULT_PARTICIPANTS = [20, 130, 500]
+RESULTS_DIR = '../benchmarks/'
+
+
+def run_scale(scale):
+    '''
+    INPUT: dict
+        - scale: keyword arguments for synthetic_data.generate (n_participants, n_days, ...)
+    OUTPUT: dict
+
+    Generates a synthetic study of the given scale and runs the ModelTester pipeline on it:
+    create_feature_label_mat, create_cv_pipeline and fit_score_models with a 20-tree random
+    forest. Returns ModelTester's instrumentation records as the stages. Meant to run in a fresh
+    process (see run_benchmarks), so peak memory is the scale's own.
+    '''
+    data_dir = tempfile.mkdtemp() + '/'
+    try:
+        row_counts = generate(data_dir, **scale)
+        mt = ModelTester(FEATURE_TEXT_FILES, ['happy'], [], data_dir=data_dir)
+        mt.create_feature_label_mat()
+        mt.create_cv_pipeline(5)
+        rfr = RandomForestRegressor(n_estimators=20, random_state=42)
+        mt.fit_score_models({rfr: 'rfr -- Random Forest, 20 trees'})
+    finally:
+        shutil.rmtree(data_dir)
+    return {'scale': scale, 'rows': row_counts, 'feature_label_mat_shape': list(mt.feature_label_mat.shape), \
+            'stages': mt.instrumentation.records, 'peak_rss_mb': peak_rss_mb()}
+
+
+def _git_commit():
+    '''
+    INPUT: None
+    OUTPUT: string
+    '''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(scales, results_dir=RESULTS_DIR):
+    '''
+    INPUT: list of dicts, string
+    OUTPUT: string
+
+    Runs run_scale for each scale, each in a fresh process, and saves the results as JSON in
+    results_dir, named by commit and time so runs on different commits can be compared.
+    Returns the path written.
+    '''
+    results = {'commit': _git_commit(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'scales': []}
+    for scale in scales:
+        pool = Pool(1, maxtasksperchild=1)
+        try:
+            result = pool.apply(run_scale, (scale,))
+        finally:
+            pool.close()
+            pool.join()
+        results['scales'].append(result)
+        print "Benchmark: %s done in %.1f s, peak %.0f MB" % \
+              (scale, sum(stage['wall_s'] for stage in result['stages'] if stage['depth'] == 0), result['peak_rss_mb'])
+
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    path = os.path.join(results_dir, 'benchmark_%s_%s.json' % (results['commit'], time.strftime('%Y%m%d_%H%M%S')))
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def _stage_times(stages):
+    '''
+    INPUT: list of dicts
+    OUTPUT: list of (string, float)
+
+    Returns the total wall time of each stage name (e.g., 'fit' summed over every fold), in order of
+    first appearance, with names indented by nesting depth.
+    '''
+    names, totals = [], {}
+    for stage in stages:
+        name = '  ' * stage['depth'] + stage['stage']
+        if name not in totals:
+            names.append(name)
+            totals[name] = 0.
+        totals[name] += stage['wall_s']
+    return [(name, totals[name]) for name in names]
+
+
+def compare(old_path, new_path):
+    '''
+    INPUT: string, string
+    OUTPUT: None
+
+    Prints the wall time of each stage at each scale in two saved benchmark runs, and the ratio
+    new / old (above 1 means the new run is slower).
+    '''
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print "%-45s %10s %10s %7s" % ('stage (' + old['commit'] + ' --> ' + new['commit'] + ')', 'old s', 'new s', 'ratio')
+    for old_scale, new_scale in zip(old['scales'], new['scales']):
+        print "\n", new_scale['scale']
+        old_times = dict(_stage_times(old_scale['stages']))
+        for name, new_time in _stage_times(new_scale['stages']):
+            old_time = old_times.get(name)
+            ratio = new_time / old_time if old_time else float('nan')
+            print "%-45s %10.3f %10.3f %7.2f" % (name, old_time or float('nan'), new_time, ratio)
+        print "%-45s %10.0f %10.0f" % ('peak RSS (MB)', old_scale['peak_rss_mb'], new_scale['peak_rss_mb'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times the ModelTester pipeline on synthetic data.")
+    parser.add_argument('--participants', type=int, nargs='+', default=DEFAULT_PARTICIPANTS)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--events-per-day', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two saved runs instead")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    scales = [{'n_participants': n, 'n_days': args.days, 'events_per_day': args.events_per_day, 'seed': args.seed} \
+              for n in args.participants]
+    print "Benchmark results saved to", run_benchmarks(scales, args.results_dir)
@@ -1,39 +1,80 @@
+import re
+import numpy as np
 import pandas as pd
-import string
 
-def _read_clean(fname):
+DATE_FORMAT = '%Y-%m-%d'   # Format of the dates in the survey's 'date' and 'name' columns
+ITEM_RE = re.compile(r'''(["'])(.*?)\1''')    # A quoted item of questions_raw or answers_raw: (quote, text)
+MOODS = ['happy', 'stressed', 'productive']
+
+def _read_clean(fname, drop_counts, data_dir='../data/'):
     '''
-    INPUT: string
+    INPUT: string, dict, string
     OUTPUT: DataFrame
 
-    Reads in CSV file and returns a cleaned DataFrame.
+    Reads in CSV file and returns a cleaned DataFrame. Every step works on whole columns at once.
+    Counts of rows dropped are added to drop_counts, keyed by reason.
     '''
-    input_name = '../data/' + fname
+    input_name = data_dir + fname
     df_phone_survey = pd.read_csv(input_name)
-    df_mood_qs = df_phone_survey[df_phone_survey['questions_raw'].map(lambda x: string.find(x, 'happy') >= 0)]
-    df_mood_qs.loc[:, 'answer_date'] = df_mood_qs['date'].map(lambda x: pd.to_datetime(x.split()[0]))
-    df_mood_qs.loc[:, 'date'] = df_mood_qs['name'].map(lambda x: pd.to_datetime(x.split()[1]))
-    ''' Drops rows where not all answers are filled in'''
-    df_mood_qs.loc[:, 'answers_len'] = df_mood_qs['answers_raw'].map(lambda x: len(x))
-    df_mood_qs = df_mood_qs[((df_mood_qs['answers_len'] >= 42) & (df_mood_qs['answers_len'] <= 44))] # sic
-    return df_mood_qs
+    df_mood_qs = df_phone_survey[df_phone_survey['questions_raw'].str.contains('happy', regex=False, na=False)].copy()
+    df_mood_qs['answer_date'] = pd.to_datetime(df_mood_qs['date'].str.split(n=1, expand=True)[0], \
+                                               format=DATE_FORMAT, errors='coerce')
+    df_mood_qs['date'] = pd.to_datetime(df_mood_qs['name'].str.split(n=2, expand=True)[1], \
+                                        format=DATE_FORMAT, errors='coerce')
+    bad_dates = pd.isnull(df_mood_qs['answer_date']) | pd.isnull(df_mood_qs['date'])
+    drop_counts['unparsable date'] = int(bad_dates.sum())
+    return df_mood_qs[~bad_dates]
 
-def _extract_mood_responses(df_mood_qs, poss_labels):
+def _question_positions(questions_raw, label):
     '''
-    INPUT: DataFrame
+    INPUT: Series, string
+    OUTPUT: Series
+
+    For each row, returns the position among the quoted questions of questions_raw of the first
+    one mentioning label (NaN if none does). Each distinct questions_raw is parsed only once.
+    '''
+    positions = {}
+    for questions in questions_raw.unique():
+        matches = [i for i, question in enumerate(ITEM_RE.findall(questions)) if label in question[1].lower()]
+        positions[questions] = matches[0] if matches else np.nan
+    return questions_raw.map(positions)
+
+def _extract_mood_responses(df_mood_qs, poss_labels, drop_counts):
+    '''
+    INPUT: DataFrame, list, dict
     OUTPUT: DataFrame
 
-    Extracts participants' numerical rankings of their daily moods.
+    Extracts participants' numerical rankings of their daily moods for every label in
+    poss_labels. answers_raw is split into its quoted answers in one regex pass, and each mood's
+    answer is the one at the position of the question mentioning that mood in questions_raw, so
+    nothing depends on fixed character offsets or on the length of answers_raw.
+    Rows are dropped, and counted in drop_counts, when for any label in poss_labels there is
+    no such question, no answer at its position, or a non-numeric answer (e.g., '>').
     '''
-    if poss_labels.count('happy') > 0:
-        df_mood_qs['happy'] = df_mood_qs['answers_raw'].map(lambda x: int(x[17]))
-    if poss_labels.count('stressed') > 0:
-        df_mood_qs['stressed'] = df_mood_qs['answers_raw'].map(lambda x: int(x[21]))
-    if poss_labels.count('productive') > 0:
-        df_mood_qs['productive'] = df_mood_qs['answers_raw'].map(lambda x: x[25])
-        df_mood_qs = df_mood_qs[df_mood_qs['productive'] != '>']    # Drops very few
-        df_mood_qs.loc[:, 'productive'] = df_mood_qs['productive'].map(lambda x: int(x))
-    df_mood_qs.drop(['name', 'answers_len', 'questions_raw', 'answers_raw'], axis=1, inplace=True)
+    answer_items = df_mood_qs['answers_raw'].str.findall(ITEM_RE)
+    to_drop = pd.Series(False, index=df_mood_qs.index)
+    for label in MOODS:
+        if poss_labels.count(label) == 0:
+            continue
+        positions = _question_positions(df_mood_qs['questions_raw'], label)
+        raw_answers = pd.Series(np.nan, index=df_mood_qs.index, dtype=object)
+        for position in positions.dropna().unique():     # Typically a single position
+            at_position = (positions == position).values
+            raw_answers[at_position] = answer_items[at_position].str.get(int(position)).str.get(1)
+        raw_answers = raw_answers.replace('', np.nan)
+        answers = pd.to_numeric(raw_answers, errors='coerce')
+
+        drop_counts['no ' + label + ' question'] = int(pd.isnull(positions).sum())
+        drop_counts['missing ' + label + ' answer'] = int((pd.notnull(positions) & pd.isnull(raw_answers)).sum())
+        drop_counts['bad ' + label + ' answer'] = int((pd.notnull(raw_answers) & pd.isnull(answers)).sum())
+        df_mood_qs[label] = answers
+        to_drop |= pd.isnull(answers)
+
+    df_mood_qs = df_mood_qs[~to_drop]
+    for label in MOODS:
+        if poss_labels.count(label) > 0:
+            df_mood_qs[label] = df_mood_qs[label].astype(int)
+    df_mood_qs = df_mood_qs.drop(['name', 'questions_raw', 'answers_raw'], axis=1)
     return df_mood_qs
 
 def _create_dummies(df_mood_qs, to_dummyize, very_cutoff_inclusive, very_un_cutoff_inclusive):
@@ -55,7 +96,8 @@ def _create_dummies(df_mood_qs, to_dummyize, very_cutoff_inclusive, very_un_cuto
         df_mood_qs[very_un_name] = 0 + (df_mood_qs[lab] <= 2)
     return df_mood_qs
 
-def create_poss_labels(fname, poss_labels, to_dummyize, very_cutoff_inclusive=6, very_un_cutoff_inclusive=2, answer_offset_cutoff=-1):
+def create_poss_labels(fname, poss_labels, to_dummyize, very_cutoff_inclusive=6, very_un_cutoff_inclusive=2, answer_offset_cutoff=-1, \
+                       drop_counts=None, data_dir='../data/'):
     '''
     INPUT: string, int
     OUTPUT: DataFrame
@@ -64,6 +106,9 @@ def create_poss_labels(fname, poss_labels, to_dummyize, very_cutoff_inclusive=6,
 
     --> answer_offset_cutoff: if != -1, answers submitted *at least* answer_offset_cutoff
         days after the date in question will be omitted
+    --> drop_counts: if given, a dict filled in with the number of survey rows dropped for each
+        reason (unparsable dates, missing or bad answers per label, answer timing)
+    --> data_dir: directory containing fname
 
     Columns as follows (indented are optional dummies specified by to_dummyize parameter):
         - participantID
@@ -81,15 +126,23 @@ def create_poss_labels(fname, poss_labels, to_dummyize, very_cutoff_inclusive=6,
             - very_productive, 1 if productive >= very_cutoff_inclusive
             - very_unproductive, 1 if productive <= very_un_cutoff_inclusive
     '''
-    df_mood_qs = _read_clean(fname)
-    df_mood_qs = _extract_mood_responses(df_mood_qs, poss_labels)
+    if drop_counts is None:
+        drop_counts = {}
+    df_mood_qs = _read_clean(fname, drop_counts, data_dir)
+    df_mood_qs = _extract_mood_responses(df_mood_qs, poss_labels, drop_counts)
     df_mood_qs = _create_dummies(df_mood_qs, to_dummyize, very_cutoff_inclusive, very_un_cutoff_inclusive)
 
     ''' Drops where the survey is answered before the corresponding date has passed '''
     df_mood_qs['answer_offset_days'] = df_mood_qs['answer_date'] - df_mood_qs['date']
-    df_mood_qs = df_mood_qs[df_mood_qs['answer_offset_days'] >= pd.to_timedelta('0 days')]
+    answered_early = df_mood_qs['answer_offset_days'] < pd.to_timedelta('0 days')
+    drop_counts['answered before date'] = int(answered_early.sum())
+    df_mood_qs = df_mood_qs[~answered_early]
     if answer_offset_cutoff != -1:
-        df_mood_qs = df_mood_qs[df_mood_qs['answer_offset_days'] < answer_offset_cutoff]
+        answered_late = df_mood_qs['answer_offset_days'] >= pd.to_timedelta(answer_offset_cutoff, unit='D')
+        drop_counts['answered too late'] = int(answered_late.sum())
+        df_mood_qs = df_mood_qs[~answered_late]
     df_mood_qs.drop(['answer_offset_days', 'answer_date'], axis=1, inplace=True)
 
+    print "Survey rows dropped:", ", ".join("%s: %d" % (reason, n) for reason, n in sorted(drop_counts.items()))
+
     return df_mood_qs
@@ -0,0 +1,180 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from datetime import date
+import numpy as np
+import pandas as pd
+
+
+def fingerprint(df):
+    '''
+    INPUT: DataFrame
+    OUTPUT: string
+
+    Returns a hash of df's contents (column names, dtypes, index and values), so cached results
+    derived from df can be invalidated when it changes. String and categorical columns are
+    hashed via their integer codes and categories. Column names are hashed as unicode, so a frame
+    loaded by FrameCache (whose names come back from JSON as unicode) has the same fingerprint as
+    the frame that was saved.
+    '''
+    col_names = [unicode(col_name) for col_name in df.columns]
+    md5 = hashlib.md5(repr((df.shape, col_names, [str(dtype) for dtype in df.dtypes])))
+    md5.update(np.ascontiguousarray(np.asarray(df.index)).tostring() if df.index.dtype.kind in 'biufmM' \
+               else repr(list(df.index)))
+    for col_name in df.columns:
+        col = df[col_name]
+        if col.dtype.kind in 'biufcmM':
+            md5.update(np.ascontiguousarray(col.values).tostring())
+        else:
+            categorical = pd.Categorical(col)
+            md5.update(np.ascontiguousarray(categorical.codes).tostring())
+            md5.update(repr(list(categorical.categories)))
+    return md5.hexdigest()
+
+
+class FrameCache(object):
+    def __init__(self, cache_dir, max_bytes=None):
+        '''
+        INPUT: string, int
+            - cache_dir: directory in which DataFrames are stored, one subdirectory per key.
+            - max_bytes: if set, least recently used entries are evicted once the cache exceeds it.
+        OUTPUT: None
+
+        Class constructor.
+        Frames are stored column by column as NumPy .npy files. On load the files are read through
+        memory maps, but DataFrame copies them into its own blocks, so a loaded frame is an ordinary
+        in-memory DataFrame (each column is copied once, with no intermediate read buffer).
+        String and categorical columns are stored as integer codes plus a small categories array;
+        columns of datetime.date objects are stored as datetime64[D].
+        '''
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, input_name, **params):
+        '''
+        INPUT: string, keyword arguments
+        OUTPUT: string
+
+        Returns a key identifying the cleaned version of input_name: its absolute path, mtime
+        and size, plus any cleaning parameters (dates, column limits, etc.) passed in params.
+        '''
+        stat = os.stat(input_name)
+        fields = [os.path.abspath(input_name), stat.st_mtime, stat.st_size] + sorted(params.items())
+        return hashlib.md5(repr(fields)).hexdigest()
+
+    def content_key(self, **params):
+        '''
+        INPUT: keyword arguments
+        OUTPUT: string
+
+        Returns a key identifying a result by its parameters alone, e.g., the fingerprint of the
+        DataFrame it was computed from plus the options it was computed with.
+        '''
+        return hashlib.md5(repr(sorted(params.items()))).hexdigest()
+
+    def _column_kind(self, col):
+        '''
+        INPUT: Series
+        OUTPUT: string
+
+        Returns how a column is stored: 'category', 'date', 'object', or 'numeric'.
+        '''
+        if str(col.dtype) == 'category':
+            return 'category'
+        if col.dtype.kind in 'biufcmM':
+            return 'numeric'
+        non_null = col.dropna()
+        if len(non_null) > 0 and type(non_null.iloc[0]) == date:
+            return 'date'
+        return 'object'
+
+    def save(self, key, df):
+        '''
+        INPUT: string, DataFrame
+        OUTPUT: None
+
+        Writes df under key. Written to a temporary directory first, then renamed into place,
+        so an interrupted save never leaves a partial entry behind.
+        '''
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir)
+        columns = []
+        for i, col_name in enumerate(df.columns):
+            col = df[col_name]
+            kind = self._column_kind(col)
+            col_path = os.path.join(tmp_path, '%d.npy' % i)
+            if kind in ('category', 'object'):
+                categorical = pd.Categorical(col)
+                np.save(col_path, np.asarray(categorical.codes))
+                np.save(os.path.join(tmp_path, '%d_cats.npy' % i), np.asarray(categorical.categories, dtype=object))
+            elif kind == 'date':
+                np.save(col_path, pd.to_datetime(col).values.astype('datetime64[D]'))
+            else:
+                np.save(col_path, col.values)
+            columns.append([col_name, kind])
+        np.save(os.path.join(tmp_path, 'index.npy'), np.asarray(df.index))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'columns': columns}, f)
+
+        path = os.path.join(self.cache_dir, key)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        '''
+        INPUT: None
+        OUTPUT: None
+
+        If max_bytes is set, deletes least recently used entries (by directory mtime, which load
+        refreshes) until the cache fits. The most recent entry is always kept.
+        '''
+        if self.max_bytes is None:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path)
+            total -= size
+
+    def load(self, key):
+        '''
+        INPUT: string
+        OUTPUT: DataFrame (or None if key is not cached)
+
+        Reads the DataFrame stored under key. Columns and codes are read through memory maps and
+        copied into the returned frame, which does not stay memory-mapped.
+        '''
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(path):
+            return None
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        os.utime(path, None)    # Marks as recently used for _evict
+
+        data, col_names = {}, []
+        for i, (col_name, kind) in enumerate(meta['columns']):
+            values = np.load(os.path.join(path, '%d.npy' % i), mmap_mode='r')
+            if kind in ('category', 'object'):
+                categories = np.load(os.path.join(path, '%d_cats.npy' % i), allow_pickle=True)
+                values = pd.Categorical.from_codes(np.asarray(values), categories)
+                if kind == 'object':
+                    values = np.asarray(values, dtype=object)
+            elif kind == 'date':
+                values = pd.DatetimeIndex(np.asarray(values).astype('datetime64[ns]')).date
+            data[col_name] = values
+            col_names.append(col_name)
+        index = np.load(os.path.join(path, 'index.npy'), allow_pickle=True)
+        return pd.DataFrame(data, index=index, columns=col_names)
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+from data_cache import FrameCache, fingerprint
+
+MISSING_CODE = -1   # Code of missing IDs/hashes
+''' Encoded columns and the namespace each draws its codes from (participant IDs share one) '''
+NAMESPACES = {'participantID': 'participant', 'participantID.A': 'participant', 'participantID.B': 'participant',
+              'number.hash': 'contact', 'address': 'device'}
+
+
+class Encoder(object):
+    def __init__(self, state_dir=None):
+        '''
+        INPUT: string
+            - state_dir: if set, directory in which the dictionaries are persisted between runs
+                         (shared with IncrementalState, whose aggregates hold the codes).
+        OUTPUT: None
+
+        Class constructor.
+        Replaces participant IDs, phone-number hashes and Bluetooth addresses with compact int32
+        codes, so groupbys and merges work on integers rather than Python strings. Each namespace
+        keeps a reversible dictionary (an Index of the original values, position = code); new
+        values are appended, so existing codes never change.
+        '''
+        self.frame_cache = FrameCache(state_dir) if state_dir else None
+        self.categories = {}
+        if self.frame_cache:
+            for namespace in set(NAMESPACES.values()):
+                df = self.frame_cache.load('encoding_' + namespace)
+                if df is not None:
+                    self.categories[namespace] = pd.Index(df['value'].values, dtype=object)
+
+    def codes(self, namespace, values):
+        '''
+        INPUT: string, array-like
+        OUTPUT: array
+
+        Returns the int32 codes of values in namespace (MISSING_CODE where missing), adding any
+        values not seen before to the dictionary.
+        '''
+        values = np.asarray(values, dtype=object)
+        known = self.categories.get(namespace, pd.Index([], dtype=object))
+        codes = known.get_indexer(values)
+        new = (codes == -1) & pd.notnull(values)
+        if new.any():
+            known = known.append(pd.Index(pd.unique(values[new]), dtype=object))
+            self.categories[namespace] = known
+            codes = known.get_indexer(values)
+        codes[pd.isnull(values)] = MISSING_CODE
+        return codes.astype(np.int32)
+
+    def values(self, namespace, codes):
+        '''
+        INPUT: string, array-like
+        OUTPUT: array
+
+        Inverse of codes: returns the original values (NaN for MISSING_CODE).
+        '''
+        codes = np.asarray(codes, dtype=np.int64)
+        categories = np.asarray(self.categories.get(namespace, []), dtype=object)
+        present = codes != MISSING_CODE
+        values = np.empty(len(codes), dtype=object)
+        values[present] = categories[codes[present]]
+        values[~present] = np.nan
+        return values
+
+    def encode(self, df):
+        '''
+        INPUT: DataFrame
+        OUTPUT: DataFrame
+
+        Returns a copy of df with every column in NAMESPACES replaced by its codes.
+        '''
+        df = df.copy()
+        for col in df.columns:
+            if col in NAMESPACES:
+                df[col] = self.codes(NAMESPACES[col], df[col])
+        return df
+
+    def decode(self, df):
+        '''
+        INPUT: DataFrame
+        OUTPUT: DataFrame
+
+        Inverse of encode: returns a copy of df with the original values restored.
+        '''
+        df = df.copy()
+        for col in df.columns:
+            if col in NAMESPACES:
+                df[col] = self.values(NAMESPACES[col], df[col])
+        return df
+
+    def fingerprint(self):
+        '''
+        INPUT: None
+        OUTPUT: string
+
+        Returns a hash of the dictionaries, so cached results that depend on the values behind the
+        codes (not just the codes) can be invalidated when they change.
+        '''
+        namespaces = sorted(self.categories.keys())
+        values = [np.asarray(self.categories[namespace], dtype=object) for namespace in namespaces]
+        return fingerprint(pd.DataFrame({'namespace': np.repeat(namespaces, [len(v) for v in values]).astype(object), \
+                                         'value': np.concatenate([np.array([], dtype=object)] + values)}))
+
+    def save(self):
+        '''
+        INPUT: None
+        OUTPUT: None
+
+        Persists the dictionaries to state_dir, if set.
+        '''
+        if self.frame_cache:
+            for namespace, categories in self.categories.items():
+                self.frame_cache.save('encoding_' + namespace, pd.DataFrame({'value': np.asarray(categories, dtype=object)}))
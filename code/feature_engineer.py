@@ -1,12 +1,61 @@
+import numpy as np
 import pandas as pd
-from pandas import Timestamp
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from pandas.tseries.offsets import *
-import networkx as nx
-from networkx.convert_matrix import from_pandas_dataframe
+from scipy import sparse
+from scipy.sparse.linalg import eigsh
+from data_cache import fingerprint
+from instrumentation import Instrumentation
+from encoding import MISSING_CODE, NAMESPACES
+
+BUCKETS = ['_top1', '_2_4', '_5_10']     # Suffixes for the top-k contact buckets
+BUCKET_BY_RANK = dict([(0, '_top1')] + [(i, '_2_4') for i in range(1, 4)] + [(i, '_5_10') for i in range(4, 10)])
+BATTERY_EXTRA_STATS = ['std', 'hours_plugged', 'discharge_rate']
+BATTERY_EXTRA_COLS = ['level_std', 'temperature_std', 'voltage_std', 'hours_plugged', 'discharge_rate']   # Added by battery_stats
+BATTERY_MAX_GAP_HOURS = 2   # Longer gaps between battery readings (e.g., phone off) aren't counted as time plugged/unplugged
+CENTRALITY_COLS = ['degree_centrality', 'eigen_centrality', 'eigen_centrality_weighted']
+CENTRALITY_CACHE_SIZE = 1000   # Most edge lists whose centrality measures are kept in _centrality_cache
+_centrality_cache = OrderedDict()   # Edge-list fingerprint --> centrality dicts, shared by every FeatureEngineer; least recently used first
+
+
+def _present(col):
+    '''
+    INPUT: Series
+    OUTPUT: Series of bools
+
+    True where an ID/hash column has a value, whether raw (NaN if missing) or encoded by
+    Encoder (MISSING_CODE if missing).
+    '''
+    return pd.notnull(col) & (col != MISSING_CODE)
+
+
+def _principal_eigenvector(A):
+    '''
+    INPUT: sparse matrix
+    OUTPUT: array
+
+    Returns the principal eigenvector of the symmetric, non-negative matrix A, scaled to unit
+    length with non-negative entries. Uses ARPACK, falling back to a dense solver for tiny graphs.
+    Matches NetworkX's eigenvector_centrality when the principal eigenvalue is unique, as it is for
+    connected graphs. On disconnected graphs the two can differ (and NetworkX's power iteration
+    may not converge); ARPACK starts from a uniform vector so the result is at least deterministic.
+    '''
+    n = A.shape[0]
+    if n <= 2:
+        vals, vecs = np.linalg.eigh(A.toarray())
+        vec = vecs[:, np.argmax(vals)]
+    else:
+        vals, vecs = eigsh(A.astype(float), k=1, which='LA', v0=np.ones(n))
+        vec = vecs[:, 0]
+    vec = np.abs(vec)
+    return vec / np.linalg.norm(vec)
+
+
 
 class FeatureEngineer(object):
-    def __init__(self, df, df_name, advanced=False, add_centrality_chars=False):
+    def __init__(self, df, df_name, advanced=False, add_centrality_chars=False, centrality_window_days=None, \
+                 battery_stats=None, instrumentation=None, encoder=None):
         '''
         INPUT: DataFrame, string, bool, bool
             - df: The DataFrame to engineer.
@@ -16,14 +65,26 @@ class FeatureEngineer(object):
                         Available for df_SMSLog, df_CallLog, df_BluetoothProximity.
             - add_centrality_chars: If advanced=True, whether to add in graph centrality measures
                                     for each participant using Bluetooth data.
+            - centrality_window_days: If add_centrality_chars, also adds centrality measures computed
+                                      each day over the trailing window of this many days.
+            - battery_stats: For df_Battery, list of extra statistics to add (see engineer_battery).
+            - instrumentation: Instrumentation to record engineer's stages in; a new one if not set.
+            - encoder: If df's IDs/hashes are encoded, the Encoder that encoded them. Used to rank
+                       equally frequent targets by their original values (see _sort_totals).
         OUTPUT: None
 
         Class constructor.
+        If df has an 'n_events' column, each row stands for that many events (e.g., rows already
+        aggregated by IncrementalState); otherwise each row is a single event.
         '''
         self.df = df
         self.df_name = df_name
         self.advanced = advanced    # False-->engineer basic features, True-->advanced
         self.add_centrality_chars = add_centrality_chars
+        self.centrality_window_days = centrality_window_days
+        self.battery_stats = battery_stats or []
+        self.instrumentation = instrumentation or Instrumentation()
+        self.encoder = encoder
         self.init_cols = list(df.columns.values)
 
         if df_name == 'df_SMSLog':
@@ -42,10 +103,21 @@ class FeatureEngineer(object):
             self.target = 'address'
             if advanced:
                 self.target = 'participantID.B'
-                self.df = self.df[pd.notnull(self.df['participantID.B'])]
+                self.df = self.df[_present(self.df['participantID.B'])]
         elif df_name == 'df_Battery':   # No 'target' attribute, because adv. features N/A for battery
             self.nickname = 'battery'
 
+    def _n_events(self):
+        '''
+        INPUT: None
+        OUTPUT: Series
+
+        Returns the number of events each row of self.df stands for (1 unless df has 'n_events').
+        '''
+        if 'n_events' in self.df.columns:
+            return self.df['n_events']
+        return pd.Series(1, index=self.df.index)
+
     def _calc_incoming_outgoing(self):
         '''
         INPUT: None
@@ -54,14 +126,17 @@ class FeatureEngineer(object):
         Calculates counts of incoming and outgoing texts/calls each day for each participant.
         Results in columns: participantID, date, [nickname]_incoming, [nickname]_outgoing, [nickname]_diff
         '''
-        self.df['cnt'] = 1
-        self.df = pd.DataFrame(self.df.groupby(['participantID', 'type', 'date'])['cnt'].count()).reset_index()
+        self.df['cnt'] = self._n_events()
+        self.df = pd.DataFrame(self.df.groupby(['participantID', 'type', 'date'])['cnt'].sum()).reset_index()
         self.df = self.df.set_index(['participantID', 'date', 'type'])
         self.df = self.df.unstack()
         self.df = self.df.reset_index()
         self.df.columns = [' '.join(col).strip() for col in self.df.columns.values]
         self.df = self.df.fillna(0)
         self.df = self.df.rename(columns={'cnt incoming': self.nickname+'_incoming', 'cnt outgoing': self.nickname+'_outgoing'})
+        for col in [self.nickname+'_incoming', self.nickname+'_outgoing']:
+            if col not in self.df.columns:  # E.g., a few days' rows with no outgoing texts
+                self.df[col] = 0
         self.df[self.nickname+'_diff'] = self.df[self.nickname+'_incoming'] - self.df[self.nickname+'_outgoing']
         self.df[self.nickname+'_total'] = self.df[self.nickname+'_incoming'] + self.df[self.nickname+'_outgoing']
 
@@ -72,15 +147,75 @@ class FeatureEngineer(object):
 
         For every participant, calculates degree centrality, Eigenvector centrality, and
         weighted Eigenvector centrality (the last being weighted by the df's 'cnt' column).
+        All three come from one sparse adjacency matrix; results are cached by edge list.
+        '''
+        df = df_totals[df_totals['participantID'] > df_totals['participantID.B']]
+        df = df[['participantID', 'participantID.B', 'cnt']].reset_index(drop=True)
+        key = fingerprint(df)
+        if key in _centrality_cache:
+            _centrality_cache[key] = _centrality_cache.pop(key)   # Marks as most recently used
+            return _centrality_cache[key]
+
+        n_edges = df.shape[0]
+        codes, nodes = pd.factorize(np.concatenate([df['participantID'].values, df['participantID.B'].values]))
+        n_nodes = len(nodes)
+        if n_nodes <= 1:
+            centrality = tuple(dict((node, 1.0) for node in nodes) for _ in range(3))
+        else:
+            rows, cols = np.concatenate([codes[:n_edges], codes[n_edges:]]), np.concatenate([codes[n_edges:], codes[:n_edges]])
+            weights = np.tile(df['cnt'].values.astype(float), 2)
+            A_weighted = sparse.csr_matrix((weights, (rows, cols)), shape=(n_nodes, n_nodes))
+            A = sparse.csr_matrix((np.ones(2 * n_edges), (rows, cols)), shape=(n_nodes, n_nodes))
+            degree = np.diff(A.indptr) / float(n_nodes - 1)
+            centrality = (dict(zip(nodes, degree)), dict(zip(nodes, _principal_eigenvector(A))), \
+                          dict(zip(nodes, _principal_eigenvector(A_weighted))))
+
+        _centrality_cache[key] = centrality
+        while len(_centrality_cache) > CENTRALITY_CACHE_SIZE:
+            _centrality_cache.popitem(last=False)
+        return centrality
+
+    def _windowed_centrality(self):
         '''
-        df = df_totals.copy()
-        df = df[df['participantID'] > df['participantID.B']]
-        G = from_pandas_dataframe(df, 'participantID', 'participantID.B', 'cnt')
-        degree_centrality = nx.degree_centrality(G)
-        eigen_centrality = nx.eigenvector_centrality(G)
-        eigen_centrality_weighted = nx.eigenvector_centrality(G, weight='cnt')
+        INPUT: None
+        OUTPUT: DataFrame
 
-        return degree_centrality, eigen_centrality, eigen_centrality_weighted
+        Helper function called by _daily_stats_most_freq.
+        For every date, calculates the 3 centrality measures over the trailing
+        centrality_window_days days (interaction counts as in _totals_for_daily_stats).
+        Returns columns participantID, date, [measure]_window for each measure.
+        '''
+        df_daily = self.df[['participantID', self.target, 'date']].copy()
+        df_daily['cnt'] = self._n_events()
+        df_daily = df_daily.groupby(['participantID', self.target, 'date'])['cnt'].sum().reset_index()
+
+        df_windows = []
+        for date in sorted(pd.to_datetime(df_daily['date'].unique())):
+            start = date - timedelta(days=self.centrality_window_days - 1)
+            df_window = df_daily[(df_daily['date'] >= start) & (df_daily['date'] <= date)]
+            df_totals = df_window.groupby(['participantID', self.target])['cnt'].sum().reset_index()
+            measures = self._graph_centrality_measures(self._mirror_mean(df_totals))
+            df_day = pd.DataFrame(dict((col + '_window', pd.Series(measure)) for col, measure in zip(CENTRALITY_COLS, measures)))
+            df_day.index.name = 'participantID'
+            df_day = df_day.reset_index()
+            df_day['date'] = date
+            df_windows.append(df_day)
+        return pd.concat(df_windows, ignore_index=True)
+
+    def _mirror_mean(self, df_totals):
+        '''
+        INPUT: DataFrame
+        OUTPUT: DataFrame
+
+        For Bluetooth totals (participantID, participantID.B, 'cnt'), keeps pairs registered on both
+        parties' phones and sets 'cnt' to the mean of the two counts.
+        '''
+        df_network_cnts2 = df_totals.copy()
+        df_totals = df_totals.merge(df_network_cnts2, left_on=['participantID', self.target],\
+                                            right_on=[self.target, 'participantID'])
+        df_totals['cnt'] = df_totals[['cnt_x', 'cnt_y']].mean(axis=1)
+        df_totals.rename(columns={'participantID_x': 'participantID', self.target+'_x': self.target}, inplace=True)
+        return df_totals[['participantID', self.target, 'cnt']]
 
     def _totals_for_daily_stats(self):
         '''
@@ -98,18 +233,57 @@ class FeatureEngineer(object):
             participants, it's the mean number of interactions registered on either party's phone.
         '''
         df_totals = self.df.copy()
-        df_totals.loc[:, 'cnt'] = 1
-        df_totals = df_totals.groupby(['participantID', self.target])['cnt'].count().reset_index()
+        df_totals.loc[:, 'cnt'] = self._n_events()
+        df_totals = df_totals.groupby(['participantID', self.target])['cnt'].sum().reset_index()
 
         if self.df_name == 'df_BluetoothProximity':
-            df_network_cnts2 = df_totals.copy()
-            df_totals = df_totals.merge(df_network_cnts2, left_on=['participantID', self.target],\
-                                                right_on=[self.target, 'participantID'])
-            df_totals['cnt'] = df_totals.mean(axis=1)
-            df_totals.rename(columns={'participantID_x': 'participantID', self.target+'_x': self.target}, inplace=True)
+            df_totals = self._mirror_mean(df_totals)
 
         return df_totals[['participantID', self.target, 'cnt']]
 
+    def _sort_totals(self, df_totals):
+        '''
+        INPUT: DataFrame
+        OUTPUT: DataFrame
+
+        Helper function called by ranked_contacts and _daily_stats_most_freq.
+        Returns df_totals sorted by participant and then by 'cnt', descending, ready for
+        _rank_buckets. Ties in 'cnt' are broken on the target's original value (decoded with
+        encoder, if set) rather than its code, so the ranking doesn't depend on the order in
+        which codes were assigned (e.g., by incremental updates).
+        '''
+        df_totals = df_totals.copy()
+        df_totals['target_value'] = df_totals[self.target]
+        if self.encoder:
+            df_totals['target_value'] = self.encoder.values(NAMESPACES[self.target], df_totals[self.target])
+        df_totals.sort(['participantID', 'cnt', 'target_value'], ascending=[False, False, True], inplace=True)
+        return df_totals.drop('target_value', axis=1)
+
+    def _rank_buckets(self, df_totals):
+        '''
+        INPUT: DataFrame
+        OUTPUT: Series
+
+        Helper function called by _perday_for_daily_stats and _daily_for_daily_stats.
+        Returns each row's bucket (_top1, _2_4, _5_10) by its position within its participant's
+        (already sorted) totals; NaN past the top 10.
+        '''
+        return df_totals.groupby('participantID').cumcount().map(BUCKET_BY_RANK)
+
+    def ranked_contacts(self):
+        '''
+        INPUT: None
+        OUTPUT: DataFrame
+
+        Returns each participant's top 10 targets over the whole dataset, with columns
+        participantID, self.target, 'cnt' and 'bucket' (_top1, _2_4, _5_10), as used by the
+        advanced features. Meant for FeatureEngineers created with advanced=True.
+        '''
+        self.df = self.df.rename(columns={'participantID.A': 'participantID'})
+        df_totals = self._sort_totals(self._totals_for_daily_stats())
+        df_totals['bucket'] = self._rank_buckets(df_totals)
+        return df_totals[pd.notnull(df_totals['bucket'])]
+
     def _perday_for_daily_stats(self, df_totals):
         '''
         INPUT: DataFrame
@@ -120,33 +294,22 @@ class FeatureEngineer(object):
         '''
 
         nickname = self.nickname
-        ''' Creates [nickname]_top1, [nickname]_2_4, [nickname]_5_10, [nickname]_all'''
-        for user in df_totals['participantID'].unique():
-            df_totals.loc[df_totals['participantID'] == user, nickname+'_top1'] = \
-                        sum(df_totals[df_totals['participantID'] == user].iloc[:1]['cnt'])
-            df_totals.loc[df_totals['participantID'] == user, nickname+'_2_4'] = \
-                        sum(df_totals[df_totals['participantID'] == user].iloc[1:4]['cnt'])
-            df_totals.loc[df_totals['participantID'] == user, nickname+'_5_10'] = \
-                        sum(df_totals[df_totals['participantID'] == user].iloc[4:10]['cnt'])
-            df_totals.loc[df_totals['participantID'] == user, nickname+'_all'] = \
-                        sum(df_totals[df_totals['participantID'] == user]['cnt'])
-
-        ''' Creates the above but normalized to a per-day basis '''
-        df_totals['n_days_partic'] = df_totals['participantID'].map(dict(self.df.groupby('participantID')['date'].nunique()))
-        df_totals.loc[:, nickname+'_top1_perday'] = df_totals[nickname+'_top1'].astype(float) / df_totals['n_days_partic']
-        df_totals.loc[:, nickname+'_2_4_perday'] = df_totals[nickname+'_2_4'].astype(float) / df_totals['n_days_partic']
-        df_totals.loc[:, nickname+'_5_10_perday'] = df_totals[nickname+'_5_10'].astype(float) / df_totals['n_days_partic']
-        df_totals.loc[:, nickname+'_all_perday'] = df_totals[nickname+'_all'].astype(float) / df_totals['n_days_partic']
-        cols_to_drop = [nickname+'_top1', nickname+'_2_4', nickname+'_5_10', nickname+'_all', 'n_days_partic']
-        df_totals.drop(cols_to_drop, axis=1, inplace=True)
+        ''' Sums [nickname]_top1, [nickname]_2_4, [nickname]_5_10, [nickname]_all in one aggregation '''
+        df_ranked = df_totals[['participantID', 'cnt']].copy()
+        df_ranked['bucket'] = self._rank_buckets(df_totals)
+        bucket_sums = df_ranked.groupby(['participantID', 'bucket'])['cnt'].sum().unstack('bucket')
+        bucket_sums = bucket_sums.reindex(columns=BUCKETS).fillna(0)
+        bucket_sums['_all'] = df_ranked.groupby('participantID')['cnt'].sum()
+
+        ''' Normalizes the above to a per-day basis '''
+        n_days_partic = self.df.groupby('participantID')['date'].nunique().reindex(bucket_sums.index)
+        df_perday = bucket_sums.astype(float).div(n_days_partic, axis=0)
+        df_perday.columns = [nickname + col + '_perday' for col in df_perday.columns]
         print nickname, "daily stats per-day columns created. Creating daily value columns..."
 
-        ''' Per-day and percent columns--modifying df '''
-        perday_cols = [nickname+'_top1_perday', nickname+'_2_4_perday', nickname+'_5_10_perday', nickname+'_all_perday']
-        dnm_collapsed = df_totals[perday_cols + ['participantID']].drop_duplicates()
-        for col in perday_cols:
-            col_dict = dict(dnm_collapsed[['participantID', col]].set_index('participantID')[col])
-            self.df[col] = self.df['participantID'].map(col_dict)
+        ''' Per-day columns--modifying df '''
+        df_totals = df_totals.join(df_perday, on='participantID')
+        self.df = self.df.merge(df_perday, how='left', left_on='participantID', right_index=True)
 
         return df_totals
 
@@ -159,25 +322,25 @@ class FeatureEngineer(object):
         Adds columns to self.df, giving daily stats for each bucket for every participant.
         '''
         self.df.loc[:, 'cnt'] = 1
-        for user in df_totals['participantID'].unique():
-            top10 = list(df_totals[df_totals['participantID'] == user].iloc[:10][self.target])
-            top1 = top10[:1]
-            top_2_4 = top10[1:4]
-            top_5_10 = top10[4:10]
-
-            df_temp = self.df[self.df['participantID'] == user]
-            mask1 = df_temp[self.target] == top1[0]
-            mask_2_4 = df_temp[self.target].map(lambda x: top_2_4.count(x) > 0)
-            mask_5_10 = df_temp[self.target].map(lambda x: top_5_10.count(x) > 0)
-            mask1_dict = dict(df_temp[mask1].groupby('date')['cnt'].count())
-            mask_2_4dict = dict(df_temp[mask_2_4].groupby('date')['cnt'].count())
-            mask_5_10dict = dict(df_temp[mask_5_10].groupby('date')['cnt'].count())
-            all_dict = dict(df_temp.groupby('date')['cnt'].count())
-
-            self.df.loc[self.df['participantID'] == user, self.nickname+'_top1'] = self.df['date'].map(mask1_dict)
-            self.df.loc[self.df['participantID'] == user, self.nickname+'_2_4'] = self.df['date'].map(mask_2_4dict)
-            self.df.loc[self.df['participantID'] == user, self.nickname+'_5_10'] = self.df['date'].map(mask_5_10dict)
-            self.df.loc[self.df['participantID'] == user, self.nickname+'_all'] =  self.df['date'].map(all_dict)
+        nickname = self.nickname
+
+        ''' Buckets each target by its rank among its participant's contacts '''
+        df_ranked = df_totals[['participantID', self.target]].copy()
+        df_ranked['bucket'] = self._rank_buckets(df_totals)
+        df_ranked = df_ranked[pd.notnull(df_ranked['bucket'])]
+
+        ''' Counts interactions per (participant, date, bucket) in one pass '''
+        df_events = self.df[['participantID', 'date', self.target]].copy()
+        df_events['n_events'] = self._n_events()
+        df_events = df_events[df_events['participantID'].isin(df_totals['participantID'].unique())]
+        df_events = df_events.merge(df_ranked, how='left', on=['participantID', self.target])
+        all_cnts = df_events.groupby(['participantID', 'date'])['n_events'].sum()
+        bucket_cnts = df_events.groupby(['participantID', 'date', 'bucket'])['n_events'].sum().unstack('bucket')
+        bucket_cnts = bucket_cnts.reindex(index=all_cnts.index, columns=BUCKETS)
+        bucket_cnts.columns = [nickname + bucket for bucket in BUCKETS]
+        bucket_cnts[nickname+'_all'] = all_cnts
+
+        self.df = self.df.merge(bucket_cnts.reset_index(), how='left', on=['participantID', 'date'])
         print "Daily value columns created."
 
 
@@ -196,12 +359,22 @@ class FeatureEngineer(object):
         3 more columns with 3 centrality figures (over the whole dataset time period, not daily)
         are added.
         '''
-        df_totals = self._totals_for_daily_stats()
-        df_totals.sort(['participantID', 'cnt'], ascending=False, inplace=True)
+        stage = self.instrumentation.stage
+        with stage('_totals_for_daily_stats', self.df) as totals_stage:
+            df_totals = self._sort_totals(self._totals_for_daily_stats())
+            totals_stage.output(df_totals)
         if self.add_centrality_chars:
-            degree_centrality, eigen_centrality, eigen_centrality_weighted = self._graph_centrality_measures(df_totals)
-        df_totals = self._perday_for_daily_stats(df_totals)
-        self._daily_for_daily_stats(df_totals)
+            with stage('_graph_centrality_measures', df_totals):
+                degree_centrality, eigen_centrality, eigen_centrality_weighted = self._graph_centrality_measures(df_totals)
+            if self.centrality_window_days:
+                with stage('_windowed_centrality', self.df) as window_stage:
+                    df_window_centrality = self._windowed_centrality()
+                    window_stage.output(df_window_centrality)
+        with stage('_perday_for_daily_stats', df_totals):
+            df_totals = self._perday_for_daily_stats(df_totals)
+        with stage('_daily_for_daily_stats', self.df) as daily_stage:
+            self._daily_for_daily_stats(df_totals)
+            daily_stage.output(self.df)
 
         ''' Percent columns '''
         nickname = self.nickname
@@ -215,13 +388,15 @@ class FeatureEngineer(object):
         self.init_cols.remove('date')
         self.df.drop(self.init_cols, axis=1, inplace=True)
         self.df = self.df.drop_duplicates().reset_index()
-        self.df = self.df[pd.notnull(self.df['participantID'])]
+        self.df = self.df[_present(self.df['participantID'])]
 
         ''' Graph centrality characteristics '''
         if self.add_centrality_chars:
             self.df.loc[:, 'degree_centrality'] = self.df['participantID'].map(degree_centrality)
             self.df.loc[:, 'eigen_centrality'] = self.df['participantID'].map(eigen_centrality)
             self.df.loc[:, 'eigen_centrality_weighted'] = self.df['participantID'].map(eigen_centrality_weighted)
+            if self.centrality_window_days:
+                self.df = self.df.merge(df_window_centrality, how='left', on=['participantID', 'date'])
 
         self.df.fillna(0, inplace=True)
         print self.nickname, "'s daily stats features engineered"
@@ -240,14 +415,15 @@ class FeatureEngineer(object):
                     --> Number of distinct devices a participant is within BT proximity of each day
         '''
 
-        temp_df_bt_n = self.df.groupby(['participantID', 'date'])['address'].count().reset_index()
-        temp_df_bt_n = temp_df_bt_n.rename(columns={'address': 'bt_n'})
-        self.df['date'] = self.df['date'].map(lambda x: Timestamp(x))         # Necessary for merge
-        temp_df_bt_n['date'] = temp_df_bt_n['date'].map(lambda x: Timestamp(x)) # Necessary for merge
-        temp_df_bt_n_distinct = self.df.groupby(['participantID', 'date'])['address'].nunique().reset_index()
+        has_address = _present(self.df['address'])
+        temp_df_bt_n = self.df.loc[has_address, ['participantID', 'date']].copy()
+        temp_df_bt_n['bt_n'] = self._n_events()
+        temp_df_bt_n = temp_df_bt_n.groupby(['participantID', 'date'])['bt_n'].sum().reset_index()
+        temp_df_bt_n_distinct = self.df[has_address].groupby(['participantID', 'date'])['address'].nunique().reset_index()
         temp_df_bt_n_distinct = temp_df_bt_n_distinct.rename(columns={'address': 'bt_n_distinct'})
         self.df = self.df.merge(temp_df_bt_n, how='left', on=['participantID', 'date'])
         self.df = self.df.merge(temp_df_bt_n_distinct, how='left', on=['participantID', 'date'])
+        self.df[['bt_n', 'bt_n_distinct']] = self.df[['bt_n', 'bt_n_distinct']].fillna(0)   # Days with no known addresses
         self.df = self.df[['participantID', 'date', 'bt_n', 'bt_n_distinct']]
         self.df.drop_duplicates(inplace=True)
 
@@ -263,50 +439,110 @@ class FeatureEngineer(object):
             - plugged_mean
             - temperature_min, temperature_mean, temperature_max
             - voltage_min, voltage_mean, voltage_max
+        Plus, for each of battery_stats:
+            - 'std': level_std, temperature_std, voltage_std
+            - 'hours_plugged': hours spent plugged in
+            - 'discharge_rate': battery level lost per hour while unplugged
+        The two time-based stats need the readings' 'local_time' (kept by ModelTester._limit_dates_df);
+        each interval between consecutive readings is credited to the earlier reading's day and state.
+        All columns come from a single grouped aggregation.
         '''
+        unknown = set(self.battery_stats) - set(BATTERY_EXTRA_STATS)
+        if unknown:
+            raise ValueError("Unknown battery_stats: " + ", ".join(sorted(unknown)))
         self.df.loc[self.df['plugged'] > 1, 'plugged'] = 1
-        df_new = self.df[['participantID', 'date']].drop_duplicates().reset_index().drop('index', axis=1)
-        min_mean_max_cols = ['level', 'plugged', 'temperature', 'voltage']
-        for col in min_mean_max_cols:
-            min_name = col + "_min"
-            mean_name = col + "_mean"
-            max_name = col + "_max"
-            grouped = self.df.groupby(['participantID', 'date'])[col]
-            df_new[min_name] = grouped.min().reset_index()[col]
-            df_new[mean_name] = grouped.mean().reset_index()[col]
-            df_new[max_name] = grouped.max().reset_index()[col]
-        df_new.drop(['plugged_min', 'plugged_max'], axis=1, inplace=True)
-
-        self.df = df_new
+        col_stats = [('level', 'min'), ('level', 'mean'), ('level', 'max'), ('plugged', 'mean'), \
+                     ('temperature', 'min'), ('temperature', 'mean'), ('temperature', 'max'), \
+                     ('voltage', 'min'), ('voltage', 'mean'), ('voltage', 'max')]
+        if 'std' in self.battery_stats:
+            col_stats += [('level', 'std'), ('temperature', 'std'), ('voltage', 'std')]
+
+        time_stats = [stat for stat in ['hours_plugged', 'discharge_rate'] if stat in self.battery_stats]
+        if time_stats:
+            if 'local_time' not in self.df.columns:
+                raise ValueError("battery_stats " + ", ".join(time_stats) + " need the battery readings' local_time")
+            self.df = self.df.sort(['participantID', 'local_time'])
+            self._add_battery_intervals()
+            col_stats += [('_plugged_hours', 'sum'), ('_unplugged_hours', 'sum'), ('_level_drop', 'sum')]
+
+        how = {}
+        for col, stat in col_stats:
+            how.setdefault(col, []).append(stat)
+        df_new = self.df.groupby(['participantID', 'date']).agg(how)
+        df_new = df_new[col_stats]     # Fixed column order
+        df_new.columns = [col + '_' + stat for col, stat in col_stats]
+
+        if 'hours_plugged' in self.battery_stats:
+            df_new['hours_plugged'] = df_new['_plugged_hours_sum']
+        if 'discharge_rate' in self.battery_stats:
+            df_new['discharge_rate'] = df_new['_level_drop_sum'] / df_new['_unplugged_hours_sum'].replace(0, np.nan)
+        df_new = df_new[[col for col in df_new.columns if not col.startswith('_')]]
+
+        self.df = df_new.reset_index()
+
+    def _add_battery_intervals(self):
+        '''
+        INPUT: None
+        OUTPUT: None
+
+        Helper function called by engineer_battery, on self.df sorted by participant and time.
+        Adds the hours to each participant's next reading (0 for the last reading, or gaps
+        longer than BATTERY_MAX_GAP_HOURS) as _plugged_hours if the reading is plugged in, and, if
+        both the reading and the next one are unplugged, as _unplugged_hours along with
+        _level_drop, the level lost by the next reading. Intervals that end in a plug-in (where the
+        level rises) are left out of both, so they don't lower discharge_rate.
+        '''
+        partic = self.df['participantID'].values
+        times = self.df['local_time'].values
+        levels = self.df['level'].values.astype(float)
+        gap_hours = np.zeros(len(self.df))
+        level_drop = np.zeros(len(self.df))
+        same_partic = partic[1:] == partic[:-1]
+        gap_hours[:-1] = (times[1:] - times[:-1]) / np.timedelta64(1, 'h')
+        gap_hours[:-1][~same_partic | (gap_hours[:-1] > BATTERY_MAX_GAP_HOURS)] = 0
+        level_drop[:-1] = levels[:-1] - levels[1:]
+
+        plugged = self.df['plugged'].values
+        next_unplugged = np.zeros(len(self.df), dtype=bool)
+        next_unplugged[:-1] = plugged[1:] == 0
+        unplugged = (plugged == 0) & next_unplugged & (gap_hours > 0)
+        self.df['_plugged_hours'] = np.where(plugged == 1, gap_hours, 0)
+        self.df['_unplugged_hours'] = np.where(unplugged, gap_hours, 0)
+        self.df['_level_drop'] = np.where(unplugged, np.nan_to_num(level_drop), 0)
 
     def engineer(self):
         '''
         INPUT: None
         OUTPUT: DataFrame
 
-        Engineers a raw DataFrame and returns it.
+        Engineers a raw DataFrame and returns it, recording the run (and its main steps) in
+        instrumentation.
         '''
-        if (self.df_name == 'df_SMSLog' or self.df_name == 'df_CallLog'):
-            self.df.rename(columns={'participantID.A': 'participantID'}, inplace=True)
-            self.init_cols.remove('participantID.A')
-            self.init_cols.append('participantID')
-            if not self.advanced:
-                self._calc_incoming_outgoing()
-            else:
-                self._daily_stats_most_freq()
-
-        if self.df_name == 'df_BluetoothProximity':
-            if not self.advanced:
-                self.engineer_bt()
-            else:
-                self._daily_stats_most_freq()
-
-        if self.df_name == 'df_Battery':
-            self.engineer_battery()
-
-        ''' Converts 'date' column to Timestamp if necessary (so merge with df_labels works)'''
-        if self.df['date'][0].__class__.__name__ != 'Timestamp':
-            self.df['date'] = self.df['date'].map(lambda x: Timestamp(x))
+        stage_name = 'FeatureEngineer ' + self.df_name + (' advanced' if self.advanced else '')
+        with self.instrumentation.stage(stage_name, self.df) as stage:
+            if (self.df_name == 'df_SMSLog' or self.df_name == 'df_CallLog'):
+                self.df.rename(columns={'participantID.A': 'participantID'}, inplace=True)
+                self.init_cols.remove('participantID.A')
+                self.init_cols.append('participantID')
+                if not self.advanced:
+                    self._calc_incoming_outgoing()
+                else:
+                    self._daily_stats_most_freq()
+
+            if self.df_name == 'df_BluetoothProximity':
+                if not self.advanced:
+                    self.engineer_bt()
+                else:
+                    self._daily_stats_most_freq()
+
+            if self.df_name == 'df_Battery':
+                self.engineer_battery()
+
+            ''' Converts 'date' column to datetime64 if necessary (so merge with df_labels works)'''
+            if self.df['date'].dtype.kind != 'M':
+                self.df['date'] = pd.to_datetime(self.df['date'])
+
+            stage.output(self.df)
 
         if not self.advanced:
             print self.df_name + " basic features engineered"
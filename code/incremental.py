@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+from data_cache import FrameCache
+from encoding import MISSING_CODE
+
+''' Columns keying the aggregated event rows kept for each log source '''
+EVENT_KEYS = {'df_SMSLog': ['participantID.A', 'date', 'number.hash', 'type'],
+              'df_CallLog': ['participantID.A', 'date', 'number.hash', 'type'],
+              'df_BluetoothProximity': ['participantID', 'date', 'address', 'participantID.B']}
+BATTERY_COLS = ['level', 'plugged', 'temperature', 'voltage']
+BATTERY_STATS = ['count', 'sum', 'min', 'max']
+MISSING = '__missing__'     # Stands in for missing key values, which groupby would otherwise drop
+
+
+class IncrementalState(object):
+    def __init__(self, state_dir=None):
+        '''
+        INPUT: string
+            - state_dir: if set, directory in which the aggregates are persisted between runs.
+        OUTPUT: None
+
+        Class constructor.
+        Keeps running aggregates of the date-limited phone logs, from which every feature can be
+        recomputed without the raw rows:
+            - SMS/Call/Bluetooth: event counts per (participant, date, contact[, type]). These give
+              the contact totals behind the top-k rankings and the days-active counts behind the
+              _perday denominators, and are fed back into FeatureEngineer via its 'n_events' column.
+            - Battery: count, sum, min and max of each battery column per (participant, date).
+        '''
+        self.frame_cache = FrameCache(state_dir) if state_dir else None
+        self.tables = {}
+        if self.frame_cache:
+            for df_name in EVENT_KEYS.keys() + ['df_Battery']:
+                table = self.frame_cache.load(df_name)
+                if table is not None:
+                    self.tables[df_name] = table
+
+    def _aggregate_events(self, df_name, df):
+        '''
+        INPUT: string, DataFrame
+        OUTPUT: DataFrame
+
+        Collapses raw log rows to one row per EVENT_KEYS combination, with an 'n_events' count.
+        Encoded (integer) columns already mark missing values with MISSING_CODE.
+        '''
+        keys = EVENT_KEYS[df_name]
+        df = df[keys].copy()
+        for col in keys:
+            if col != 'date' and df[col].dtype.kind not in 'iu':
+                df[col] = df[col].astype(object).fillna(MISSING)
+        df['n_events'] = 1
+        return df.groupby(keys)['n_events'].sum().reset_index()
+
+    def _aggregate_battery(self, df):
+        '''
+        INPUT: DataFrame
+        OUTPUT: DataFrame
+
+        Collapses raw battery rows to one row per (participant, date), with the count, sum, min and
+        max of each battery column ('plugged' capped at 1, as in FeatureEngineer.engineer_battery).
+        '''
+        df = df[['participantID', 'date'] + BATTERY_COLS].copy()
+        if df['participantID'].dtype.kind not in 'iu':
+            df['participantID'] = df['participantID'].astype(object)
+        df.loc[df['plugged'] > 1, 'plugged'] = 1
+        df_agg = df.groupby(['participantID', 'date'])[BATTERY_COLS].agg(BATTERY_STATS)
+        df_agg.columns = [col + '_' + stat for col, stat in df_agg.columns.values]
+        return df_agg.reset_index()
+
+    def _combine(self, df_name, df_old, df_new):
+        '''
+        INPUT: string, DataFrame, DataFrame
+        OUTPUT: DataFrame
+
+        Merges two sets of aggregates for the same source into one.
+        '''
+        df = pd.concat([df_old, df_new], ignore_index=True)
+        if df_name == 'df_Battery':
+            how = {}
+            for col in BATTERY_COLS:
+                how.update({col + '_count': 'sum', col + '_sum': 'sum', col + '_min': 'min', col + '_max': 'max'})
+            return df.groupby(['participantID', 'date']).agg(how).reset_index()[df_old.columns]
+        return df.groupby(EVENT_KEYS[df_name])['n_events'].sum().reset_index()
+
+    def ingest(self, df_name, df):
+        '''
+        INPUT: string, DataFrame
+            - df: new date-limited rows (as returned by ModelTester._limit_dates_df)
+        OUTPUT: DataFrame, set
+            - (participantID, date) pairs with new rows
+            - participants whose whole-study aggregates changed (for Bluetooth, including the
+              participants seen in proximity, whose mutual counts changed too)
+
+        Folds new rows into the aggregates for df_name.
+        '''
+        if df_name == 'df_Battery':
+            df_new = self._aggregate_battery(df)
+            partic_col = 'participantID'
+        elif df_name in EVENT_KEYS:
+            df_new = self._aggregate_events(df_name, df)
+            partic_col = EVENT_KEYS[df_name][0]
+        else:
+            raise ValueError(df_name + " is not supported by IncrementalState")
+
+        if df_name in self.tables:
+            self.tables[df_name] = self._combine(df_name, self.tables[df_name], df_new)
+        else:
+            self.tables[df_name] = df_new
+
+        df_keys = df_new[[partic_col, 'date']].drop_duplicates().rename(columns={partic_col: 'participantID'})
+        participants = set(df_keys['participantID'])
+        if df_name == 'df_BluetoothProximity':
+            participants |= set(df_new['participantID.B']) - set([MISSING, MISSING_CODE])
+        return df_keys.reset_index(drop=True), participants
+
+    def rebuild(self, feature_dfs):
+        '''
+        INPUT: dict of df_name --> DataFrame
+        OUTPUT: None
+
+        Discards all aggregates and rebuilds them from the date-limited feature dfs given.
+        Sources IncrementalState doesn't support are skipped.
+        '''
+        self.tables = {}
+        for df_name, df in feature_dfs.items():
+            if df_name == 'df_Battery' or df_name in EVENT_KEYS:
+                self.ingest(df_name, df)
+        self.save()
+
+    def save(self):
+        '''
+        INPUT: None
+        OUTPUT: None
+
+        Persists the aggregates to state_dir, if set.
+        '''
+        if self.frame_cache:
+            for df_name, table in self.tables.items():
+                self.frame_cache.save(df_name, table)
+
+    def events(self, df_name, participants=None, df_keys=None):
+        '''
+        INPUT: string, set, DataFrame
+            - participants: if given, keeps only these participants' rows (for Bluetooth, also rows
+                            in which they were seen, so mutual counts are complete)
+            - df_keys: if given, keeps only rows for these (participantID, date) pairs
+        OUTPUT: DataFrame
+
+        Returns the aggregated event rows for df_name in the raw log format, with an 'n_events'
+        column, ready to pass to FeatureEngineer.
+        '''
+        df = self.tables[df_name]
+        partic_col = EVENT_KEYS[df_name][0]
+        if participants is not None:
+            mask = df[partic_col].isin(participants)
+            if df_name == 'df_BluetoothProximity':
+                mask = mask | df['participantID.B'].isin(participants)
+            df = df[mask]
+        if df_keys is not None:
+            df = df.merge(df_keys.rename(columns={'participantID': partic_col}), on=[partic_col, 'date'])
+        return df.replace(MISSING, np.nan).reset_index(drop=True)
+
+    def battery_features(self, df_keys=None):
+        '''
+        INPUT: DataFrame
+            - df_keys: if given, only these (participantID, date) pairs are returned
+        OUTPUT: DataFrame
+
+        Returns battery features in the format of FeatureEngineer.engineer_battery, computed from
+        the running aggregates.
+        '''
+        df = self.tables['df_Battery']
+        if df_keys is not None:
+            df = df.merge(df_keys, on=['participantID', 'date'])
+        df_new = df[['participantID', 'date']].copy()
+        for col in BATTERY_COLS:
+            df_new[col + '_min'] = df[col + '_min']
+            df_new[col + '_mean'] = df[col + '_sum'].astype(float) / df[col + '_count']
+            df_new[col + '_max'] = df[col + '_max']
+        df_new.drop(['plugged_min', 'plugged_max'], axis=1, inplace=True)
+        df_new['date'] = pd.to_datetime(df_new['date'])
+        return df_new.reset_index(drop=True)
@@ -0,0 +1,169 @@
+import os
+import csv
+import json
+import time
+import resource
+import functools
+from contextlib import contextmanager
+
+REPORT_FIELDS = ['stage', 'depth', 'wall_s', 'cpu_s', 'peak_rss_delta_mb', 'peak_rss_mb', \
+                 'rows_in', 'cols_in', 'rows_out', 'cols_out']    # Leading CSV columns; extras follow
+
+
+def peak_rss_mb():
+    '''
+    INPUT: None
+    OUTPUT: float
+
+    Returns this process's peak resident set size so far, in MB (ru_maxrss is in KB on Linux).
+    '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _cpu_s():
+    '''
+    INPUT: None
+    OUTPUT: float
+
+    Returns the user + system CPU time this process has used so far.
+    '''
+    return sum(os.times()[:2])
+
+
+class Stage(object):
+    def __init__(self, record):
+        '''
+        INPUT: dict
+        OUTPUT: None
+
+        Class constructor.
+        Handle yielded by Instrumentation.stage, for filling in the stage's outputs.
+        '''
+        self.record = record
+
+    def output(self, df):
+        '''
+        INPUT: DataFrame or array
+        OUTPUT: None
+
+        Records df's shape as the stage's output rows and columns.
+        '''
+        self.record['rows_out'], self.record['cols_out'] = _shape(df)
+
+
+def _shape(df):
+    '''
+    INPUT: DataFrame, array or None
+    OUTPUT: int, int (or None, None)
+    '''
+    if df is None:
+        return None, None
+    shape = tuple(df.shape) + (1,)
+    return int(shape[0]), int(shape[1])
+
+
+class Instrumentation(object):
+    def __init__(self, callback=None):
+        '''
+        INPUT: function
+            - callback: if set, called with each stage's record (a dict) as soon as the stage ends
+        OUTPUT: None
+
+        Class constructor.
+        Records, for every stage of the pipeline, its wall time, CPU time, peak RSS delta (how much
+        the stage raised the process's peak memory), and input/output rows and columns. Stages may
+        nest; each record's depth says how deeply. Stages run in Pool workers record into their
+        own Instrumentation, whose records are passed back and added with add.
+        '''
+        self.callback = callback
+        self.records = []
+        self.depth = 0
+
+    @contextmanager
+    def stage(self, name, df_in=None, **fields):
+        '''
+        INPUT: string, DataFrame or array, keyword arguments
+            - name: name of the stage
+            - df_in: the stage's input, whose shape is recorded
+            - fields: extra fields for the record
+        OUTPUT: Stage (context manager)
+
+        Times the enclosed block as stage name, e.g.:
+            with self.instrumentation.stage('_join_features', df_labels) as stage:
+                ...
+                stage.output(feature_label_mat)
+        Records are kept in the order stages start (so a stage comes before the stages nested in
+        it) and are passed to callback as stages end, even if the block raises.
+        '''
+        record = {'stage': name, 'depth': self.depth}
+        record['rows_in'], record['cols_in'] = _shape(df_in)
+        record['rows_out'], record['cols_out'] = None, None
+        record.update(fields)
+        self.records.append(record)
+        start_wall, start_cpu, start_rss = time.time(), _cpu_s(), peak_rss_mb()
+        self.depth += 1
+        try:
+            yield Stage(record)
+        finally:
+            self.depth -= 1
+            record['wall_s'] = time.time() - start_wall
+            record['cpu_s'] = _cpu_s() - start_cpu
+            record['peak_rss_mb'] = peak_rss_mb()
+            record['peak_rss_delta_mb'] = record['peak_rss_mb'] - start_rss
+            if self.callback:
+                self.callback(record)
+
+    def add(self, records):
+        '''
+        INPUT: list of dicts
+        OUTPUT: None
+
+        Adds records made by another Instrumentation (e.g., in a Pool worker), nested under the
+        current stage.
+        '''
+        for record in records:
+            record = dict(record)
+            record['depth'] += self.depth
+            self.records.append(record)
+            if self.callback:
+                self.callback(record)
+
+    def report(self, path):
+        '''
+        INPUT: string
+        OUTPUT: None
+
+        Writes the records to path, as CSV if path ends in .csv and as JSON otherwise.
+        '''
+        if path.endswith('.csv'):
+            extra_fields = sorted(set(field for record in self.records for field in record) - set(REPORT_FIELDS))
+            with open(path, 'wb') as f:
+                writer = csv.DictWriter(f, REPORT_FIELDS + extra_fields)
+                writer.writeheader()
+                writer.writerows(self.records)
+        else:
+            with open(path, 'w') as f:
+                json.dump(self.records, f, indent=2)
+
+
+def instrumented(attr=None):
+    '''
+    INPUT: string
+        - attr: name of the DataFrame attribute the method reads and updates (e.g., 'feature_label_mat')
+    OUTPUT: decorator
+
+    Decorates a method of a class with an instrumentation attribute, recording each call as a
+    stage named after the method, with the shape of self.[attr] before and after the call as its
+    input and output.
+    '''
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            df_in = getattr(self, attr) if attr else None
+            with self.instrumentation.stage(method.__name__, df_in) as stage:
+                result = method(self, *args, **kwargs)
+                if attr:
+                    stage.output(getattr(self, attr))
+            return result
+        return wrapper
+    return decorate
@@ -0,0 +1,201 @@
+import numpy as np
+from sklearn.externals import joblib
+
+''' Nickname and contact column of each log source, as in FeatureEngineer (advanced features) '''
+LOG_SOURCES = {'df_SMSLog': ('sms', 'number.hash'),
+               'df_CallLog': ('call', 'number.hash'),
+               'df_BluetoothProximity': ('bt', 'participantID.B')}
+BUCKETS = ['_top1', '_2_4', '_5_10']
+BATTERY_COLS = ['level', 'plugged', 'temperature', 'voltage']
+CENTRALITY_COLS = ['degree_centrality', 'eigen_centrality', 'eigen_centrality_weighted']
+
+
+def new_profile():
+    '''
+    INPUT: None
+    OUTPUT: dict
+
+    Returns an empty participant profile:
+        - 'contacts': nickname --> {contact: bucket} for the participant's top 10 contacts
+        - 'values': whole-study constants, i.e., [nickname]_[bucket]_perday and centrality measures
+        - 'medians': the participant's median of each feature
+    '''
+    return {'contacts': {}, 'values': {}, 'medians': {}}
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+class MoodPredictor(object):
+    def __init__(self, path):
+        '''
+        INPUT: string
+            - path: file written by ModelTester.export_predictor
+        OUTPUT: None
+
+        Class constructor.
+        Loads fitted models (one per label), the features_used schema and per-participant profiles,
+        and scores single (participant, date) rows from that day's logs without touching pandas.
+        '''
+        bundle = joblib.load(path)
+        self.models = bundle['models']
+        self.poss_labels = bundle['poss_labels']
+        self.features_used = list(bundle['features_used'])
+        self.partic_median_cols = set(bundle['partic_median_cols'])
+        self.profiles = bundle['profiles']
+        self.scaler = bundle['scaler']
+        self.pca = bundle['pca']
+        self.Fri_weekend = bundle['Fri_weekend']
+
+        ''' Precomputes where each feature comes from '''
+        self.base_cols = [(i, col) for i, col in enumerate(self.features_used) if not col.endswith('_demedianed')]
+        base_col_nums = dict((col, i) for i, col in self.base_cols)
+        self.demedianed_cols = []     # (position, base column, base column's position)
+        for i, col in enumerate(self.features_used):
+            if col.endswith('_demedianed'):
+                base_col = col[:-len('_demedianed')]
+                self.demedianed_cols.append((i, base_col, base_col_nums[base_col]))
+
+    def _records(self, rows):
+        '''
+        INPUT: DataFrame or list of dicts
+        OUTPUT: list of dicts
+        '''
+        if rows is None:
+            return []
+        if hasattr(rows, 'to_dict'):
+            return rows.to_dict('records')
+        return list(rows)
+
+    def _log_features(self, df_name, rows, profile, feats):
+        '''
+        INPUT: string, list of dicts, dict, dict
+        OUTPUT: None
+
+        Adds one day's basic and advanced SMS/Call/Bluetooth features to feats, matching
+        FeatureEngineer's outputs.
+        '''
+        nickname, target = LOG_SOURCES[df_name]
+        if df_name == 'df_CallLog':
+            rows = [row for row in rows if row.get('type') != 'missed']
+        if not rows:
+            return
+
+        if df_name == 'df_BluetoothProximity':
+            addresses = [row.get('address') for row in rows if not _is_missing(row.get('address'))]
+            feats['bt_n'] = len(addresses)
+            feats['bt_n_distinct'] = len(set(addresses))
+            rows = [row for row in rows if not _is_missing(row.get('participantID.B'))]
+        else:
+            type_cnts = {}
+            for row in rows:
+                row_type = str(row.get('type'))
+                if df_name == 'df_CallLog':
+                    row_type = row_type.strip('+')
+                type_cnts[row_type] = type_cnts.get(row_type, 0) + 1
+            incoming, outgoing = type_cnts.pop('incoming', 0), type_cnts.pop('outgoing', 0)
+            feats[nickname+'_incoming'], feats[nickname+'_outgoing'] = incoming, outgoing
+            feats[nickname+'_diff'], feats[nickname+'_total'] = incoming - outgoing, incoming + outgoing
+            for row_type, cnt in type_cnts.iteritems():
+                feats['cnt ' + row_type] = cnt
+
+        contacts = profile['contacts'].get(nickname)
+        if contacts is None or not rows:
+            return
+        daily = dict.fromkeys(BUCKETS + ['_all'], 0)
+        for row in rows:
+            bucket = contacts.get(row.get(target))
+            if bucket is not None:
+                daily[bucket] += 1
+            daily['_all'] += 1
+        for bucket, cnt in daily.iteritems():
+            perday = profile['values'].get(nickname + bucket + '_perday', 0)
+            feats[nickname + bucket] = cnt
+            feats[nickname + bucket + '_perday'] = perday
+            feats[nickname + bucket + '_pct'] = float(cnt) / perday if cnt > 0 else 0
+
+    def _battery_features(self, rows, feats):
+        '''
+        INPUT: list of dicts, dict
+        OUTPUT: None
+
+        Adds one day's battery features to feats, matching FeatureEngineer.engineer_battery.
+        '''
+        for col in BATTERY_COLS:
+            values = [float(row[col]) for row in rows if not _is_missing(row.get(col))]
+            if col == 'plugged':
+                values = [min(value, 1) for value in values]
+            if not values:
+                continue
+            feats[col + '_mean'] = sum(values) / len(values)
+            if col != 'plugged':
+                feats[col + '_min'], feats[col + '_max'] = min(values), max(values)
+
+    def features(self, participant, date, day_logs):
+        '''
+        INPUT: string, date, dict of df_name --> DataFrame or list of dicts
+            - day_logs: the participant's log rows for the day (4 AM to 4 AM), keyed like
+                        ModelTester.feature_dfs (e.g., 'df_SMSLog'), already cleaned as by
+                        ModelTester._limit_dates_df
+        OUTPUT: array
+
+        Returns the row of features (in features_used order) for participant on date. Missing
+        values are filled as in ModelTester: with the participant's median for Battery/Bluetooth
+        columns, 0 otherwise.
+        '''
+        profile = self.profiles.get(participant) or new_profile()
+        feats = {}
+        for df_name, rows in day_logs.iteritems():
+            if df_name == 'df_Battery':
+                self._battery_features(self._records(rows), feats)
+            elif df_name in LOG_SOURCES:
+                self._log_features(df_name, self._records(rows), profile, feats)
+        for col in CENTRALITY_COLS:
+            if col in profile['values']:
+                feats[col] = profile['values'][col]
+        feats['day_of_week'] = date.weekday()
+        feats['weekend'] = int(feats['day_of_week'] >= 5 - 1 * self.Fri_weekend)
+
+        X = np.zeros(len(self.features_used))
+        for i, col in self.base_cols:
+            value = feats.get(col)
+            if _is_missing(value) and col in self.partic_median_cols:
+                value = profile['medians'].get(col)
+            X[i] = 0 if _is_missing(value) else value
+        for i, base_col, base_i in self.demedianed_cols:
+            median = profile['medians'].get(base_col)
+            X[i] = X[base_i] - (0 if _is_missing(median) else median)
+        return X
+
+    def _predict(self, X):
+        '''
+        INPUT: 2-D array
+        OUTPUT: dict of label --> array
+        '''
+        if self.scaler is not None:
+            X = self.pca.transform(self.scaler.transform(X))
+        return dict((label, self.models[label].predict(X)) for label in self.poss_labels)
+
+    def predict(self, participant, date, day_logs):
+        '''
+        INPUT: string, date, dict of df_name --> DataFrame or list of dicts (see features)
+        OUTPUT: dict of label --> float
+
+        Predicts each label in poss_labels for participant on date.
+        '''
+        predictions = self._predict(self.features(participant, date, day_logs)[np.newaxis, :])
+        return dict((label, preds[0]) for label, preds in predictions.iteritems())
+
+    def predict_batch(self, requests):
+        '''
+        INPUT: list of (participant, date, day_logs) tuples (see features)
+        OUTPUT: list of dicts of label --> float
+
+        Predicts each label for many (participant, date) rows at once, with one model call per label.
+        '''
+        if not requests:
+            return []
+        X = np.vstack([self.features(participant, date, day_logs) for participant, date, day_logs in requests])
+        predictions = self._predict(X)
+        return [dict((label, predictions[label][i]) for label in self.poss_labels) for i in xrange(len(requests))]
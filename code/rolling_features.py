@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+ROLLING_WINDOWS = [3, 7, 14]    # Trailing window lengths, in days
+
+
+def _day_ordinals(dates):
+    '''
+    INPUT: Series or array of dates
+    OUTPUT: array
+
+    Returns dates as int64 days since the epoch.
+    '''
+    return pd.DatetimeIndex(dates).values.astype('datetime64[D]').astype(np.int64)
+
+
+def rolling_features(df, df_keys, cols, windows=ROLLING_WINDOWS, per_day=True):
+    '''
+    INPUT: DataFrame, DataFrame, list, list, bool
+        - df: daily features (e.g., a basic FeatureEngineer output), one row per (participantID, date)
+        - df_keys: (participantID, date) pairs at which to evaluate the windows, e.g., the labels
+        - cols: columns of df to aggregate
+        - windows: trailing window lengths, in days
+        - per_day: if True, a window's value is its total divided by its length in days, so days
+                   with no rows count as 0 (for event counts); if False, it is the mean over the
+                   days in the window that have a value (for, e.g., battery stats)
+    OUTPUT: DataFrame
+
+    Returns, for every row of df_keys, the trailing aggregate of each column over each window:
+    columns participantID, date and [col]_[w]d, covering the w days up to and including date.
+    Only df's rows on or before each date are used, so no future data leaks in.
+
+    Computed in one sorted pass: rows are ordered by a combined (participant, day) key, so each
+    window is a contiguous slice found by binary search, and its total is the difference of two
+    cumulative sums. Cost is linear in rows x windows (plus the sort).
+    '''
+    participants = pd.Index(pd.concat([df['participantID'], df_keys['participantID']]).astype(object).unique())
+    days, key_days = _day_ordinals(df['date']), _day_ordinals(df_keys['date'])
+    first_day = min(days.min(), key_days.min()) if len(days) else key_days.min()
+    span = max(days.max() if len(days) else 0, key_days.max()) - first_day + max(windows) + 1   # Keeps participants' key ranges apart
+
+    codes = pd.Categorical(np.asarray(df['participantID']), categories=participants).codes.astype(np.int64)
+    row_keys = codes * span + (days - first_day)
+    order = np.argsort(row_keys, kind='mergesort')
+    row_keys = row_keys[order]
+    values = df[cols].values.astype(float)[order]
+    present = ~np.isnan(values)
+    cum_sums = np.vstack([np.zeros((1, len(cols))), np.cumsum(np.where(present, values, 0), axis=0)])
+    cum_counts = np.vstack([np.zeros((1, len(cols))), np.cumsum(present, axis=0)])
+
+    key_codes = pd.Categorical(np.asarray(df_keys['participantID']), categories=participants).codes.astype(np.int64)
+    query_keys = key_codes * span + (key_days - first_day)
+    ends = np.searchsorted(row_keys, query_keys, side='right')
+
+    df_rolling = df_keys[['participantID', 'date']].copy()
+    for window in windows:
+        starts = np.searchsorted(row_keys, query_keys - (window - 1), side='left')
+        sums = cum_sums[ends] - cum_sums[starts]
+        if per_day:
+            aggs = sums / float(window)
+        else:
+            counts = cum_counts[ends] - cum_counts[starts]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                aggs = np.where(counts > 0, sums / counts, np.nan)
+        for i, col in enumerate(cols):
+            df_rolling[col + '_%dd' % window] = aggs[:, i]
+    return df_rolling.reset_index(drop=True)
@@ -8,19 +8,21 @@ from test_models import ModelTester
 
 
 if __name__ == '__main__':
-    ''' NOTE:
-    To run, may need to manually install the latest version of networkx:
-    Download the tar.gz or zip file from https://pypi.python.org/pypi/networkx/
-    (As of 1/15/2016: pip install may upgrade you to version 1.10, but you need 1.11)
-    Alternatively, you can set add_centrality_chars to False, so NetworkX will not
-    be needed.
-    '''
-
     ''' 1. FIELDS TO POTENTIALLY MODIFY ************************************* '''
     basic_features = True   # Whether to include basic features for all dfs
     advanced_call_sms_bt_features = True    # Whether to include advanced Call/SMS/Bluetooth features
     add_centrality_chars = True     # Whether to include graph centrality characteristics (Bluetooth)
+    centrality_window_days = None   # If set, also adds centrality over a trailing window of this many days
+    rolling_windows = None   # E.g., [3, 7, 14]: adds trailing aggregates of daily features over each window (days)
+    battery_stats = None    # Extra battery stats: any of 'std', 'hours_plugged', 'discharge_rate'
+    instrumentation_report = None   # E.g., 'stages.csv': saves each stage's time, memory and shape (JSON unless .csv)
     reduce_dimensions = False    # Whether to reduce the number of features. Keeps 90% of energy.
+    pca_solver = 'full'     # If reduce_dimensions: 'full', or 'randomized'/'incremental' for wide matrices
+    staged = False  # Boosting models: score every n_estimators up to the model's from one fit per fold
+    holdout_fraction = None     # If staged, e.g., 0.2: picks n_estimators on this share of each training fold
+    early_stopping_rounds = None    # If holdout_fraction, stops GBR fits after this many iterations without improving
+    search_grid = None  # E.g., {'max_depth': [2, 4], 'learning_rate': [0.05, 0.02]}: tunes gbr with halving_search
+    search_results_path = None  # If set, search progress is saved here, and an interrupted search resumes
     N_FOLDS = 5   # Number of folds to use in cross-validation
     POSS_LABELS = ['happy']#, 'stressed', 'productive']
     TO_DUMMYIZE = []#'happy']    # Mood(s) to create dummies with: happy, stressed, and/or productive
@@ -49,8 +51,8 @@ if __name__ == '__main__':
                                                  max_features=0.1, min_samples_leaf=7)
     gbr_stoch = GradientBoostingRegressor(subsample=0.1)
 
-    ''' Note: if using a model (e.g., Linear Regression) that doesn't support feature importances,
-              must comment out 3 lines near the end ofof test_models.py under the comment 'Feature Importances'
+    ''' Note: models (e.g., Linear Regression) that don't support feature importances are simply
+              left out of mt.feature_importances.
     '''
     MODELS_TO_USE = [   # Which models to test. Scroll to bottom for descriptions of each
               rfr,
@@ -110,8 +112,14 @@ if __name__ == '__main__':
     ''' 3. Runs the model tester ******************************************** '''
     mt = ModelTester(FEATURE_TEXT_FILES, POSS_LABELS, TO_DUMMYIZE, basic_features, \
                      advanced_call_sms_bt_features, add_centrality_chars=add_centrality_chars, \
-                     reduce_dimensions=reduce_dimensions)
+                     reduce_dimensions=reduce_dimensions, centrality_window_days=centrality_window_days, \
+                     rolling_windows=rolling_windows, battery_stats=battery_stats, pca_solver=pca_solver)
     mt.create_feature_label_mat()
     mt.create_cv_pipeline(N_FOLDS)
-    mt.fit_score_models(model_descrip_dict)
+    mt.fit_score_models(model_descrip_dict, staged=staged, holdout_fraction=holdout_fraction, \
+                        early_stopping_rounds=early_stopping_rounds)
+    if search_grid:
+        mt.halving_search(gbr, search_grid, results_path=search_results_path)
+    if instrumentation_report:
+        mt.instrumentation.report(instrumentation_report)
     ''' ********************************************************************* '''
@@ -0,0 +1,146 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+
+START_DATE = '2010-11-12'
+N_CONTACTS = 30         # Phone contacts per participant
+N_EXTERNAL_DEVICES = 200    # Bluetooth devices not belonging to participants
+GROUP_SIZE = 10         # Participants are split into groups of friends who see each other over Bluetooth
+QUESTIONS = ['How many hours did you sleep last night?', 'How happy were you yesterday?', \
+             'How stressed were you yesterday?', 'How productive were you yesterday?']
+
+
+def _hashes(prefix, n):
+    '''
+    INPUT: string, int
+    OUTPUT: array
+
+    Returns n distinct md5 hex strings, standing in for hashed phone numbers and device addresses.
+    '''
+    return np.array([hashlib.md5('%s-%d' % (prefix, i)).hexdigest() for i in xrange(n)], dtype=object)
+
+
+def _time_strings(times):
+    '''
+    INPUT: array of datetime64
+    OUTPUT: array of strings
+
+    Formats times as in the study's CSV files ('YYYY-MM-DD HH:MM:SS').
+    '''
+    return np.char.replace(np.datetime_as_string(times.astype('datetime64[s]')), 'T', ' ')
+
+
+def _event_cells(rng, rates):
+    '''
+    INPUT: RandomState, 2-D array
+    OUTPUT: array, array
+
+    Draws a Poisson number of events for each (participant, day) cell with the given rates and
+    returns the participant and day index of every event.
+    '''
+    counts = rng.poisson(rates).ravel()
+    cells = np.repeat(np.arange(counts.shape[0]), counts)
+    return cells // rates.shape[1], cells % rates.shape[1]
+
+
+def _event_times(rng, start, days):
+    '''
+    INPUT: RandomState, datetime64, array
+    OUTPUT: array of datetime64
+
+    Returns a uniformly random time on each of the given days (counted from start).
+    '''
+    seconds = rng.randint(0, 24 * 3600, len(days))
+    return start + days.astype('timedelta64[D]') + seconds.astype('timedelta64[s]')
+
+
+def generate(data_dir, n_participants=130, n_days=60, events_per_day=10, battery_per_day=48, \
+             start_date=START_DATE, seed=0):
+    '''
+    INPUT: string, int, int, int, int, string, int
+        - data_dir: directory to write the CSV files to (created if needed)
+        - n_participants, n_days: size of the simulated study
+        - events_per_day: mean texts per participant per day; calls and Bluetooth scans scale with it
+        - battery_per_day: battery readings per participant per day
+        - seed: random seed; the same arguments always give the same files
+    OUTPUT: dict of file name --> number of rows
+
+    Writes SMSLog.csv, CallLog.csv, Battery.csv, BluetoothProximity.csv and SurveyFromPhone.csv
+    with the columns ModelTester reads, mimicking the Friends and Family study: each participant
+    has a few dozen contacts of very different frequency, sees a group of other participants
+    (and unrelated devices) over Bluetooth, and answers a daily mood survey. A latent daily mood
+    drives both the survey answers and how social the participant is that day, so models have
+    something to find.
+    '''
+    rng = np.random.RandomState(seed)
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    start = np.datetime64(start_date, 's')
+    participants = np.array(['fa10-01-%03d' % i for i in xrange(n_participants)], dtype=object)
+    mood = rng.normal(size=(n_participants, n_days))
+    activity = np.exp(0.3 * mood) * rng.lognormal(0, 0.3, size=(n_participants, 1))
+    row_counts = {}
+
+    ''' SMS and calls: contacts chosen with Zipf-like frequencies '''
+    contact_probs = 1. / np.arange(1, N_CONTACTS + 1)
+    contact_probs /= contact_probs.sum()
+    contact_hashes = _hashes('contact', n_participants * N_CONTACTS)
+    for fname, rate, types in [('SMSLog.csv', events_per_day, ['incoming', 'outgoing']), \
+                               ('CallLog.csv', events_per_day / 3., ['incoming', 'outgoing', 'missed'])]:
+        partic, days = _event_cells(rng, rate * activity)
+        contacts = partic * N_CONTACTS + rng.choice(N_CONTACTS, len(partic), p=contact_probs)
+        df = pd.DataFrame({'participantID.A': participants[partic], 'number.hash': contact_hashes[contacts], \
+                           'type': np.array(types, dtype=object)[rng.randint(0, len(types), len(partic))], \
+                           'local_time': _time_strings(_event_times(rng, start, days))})
+        df[['participantID.A', 'number.hash', 'type', 'local_time']].to_csv(os.path.join(data_dir, fname), index=False)
+        row_counts[fname] = df.shape[0]
+
+    ''' Bluetooth: scans see a friend in the same group, an external device, or nothing '''
+    partic, days = _event_cells(rng, 2 * events_per_day * activity)
+    kind = rng.choice(3, len(partic), p=[0.4, 0.5, 0.1])
+    group_start = (partic // GROUP_SIZE) * GROUP_SIZE
+    friends = np.minimum(group_start + rng.randint(0, GROUP_SIZE, len(partic)), n_participants - 1)
+    device_hashes = _hashes('device', n_participants + N_EXTERNAL_DEVICES)
+    devices = np.where(kind == 0, friends, n_participants + rng.randint(0, N_EXTERNAL_DEVICES, len(partic)))
+    df = pd.DataFrame({'participantID': participants[partic], \
+                       'participantID.B': np.where(kind == 0, participants[friends], np.nan), \
+                       'address': np.where(kind == 2, np.nan, device_hashes[devices]), \
+                       'date': _time_strings(_event_times(rng, start, days))})
+    df = df[(kind != 0) | (friends != partic)]     # No one sees themselves
+    df[['participantID', 'participantID.B', 'address', 'date']].to_csv(os.path.join(data_dir, 'BluetoothProximity.csv'), index=False)
+    row_counts['BluetoothProximity.csv'] = df.shape[0]
+
+    ''' Battery: evenly spaced readings; charging at night, draining through the day '''
+    n_readings = n_participants * n_days * battery_per_day
+    partic = np.repeat(np.arange(n_participants), n_days * battery_per_day)
+    offsets = (np.tile(np.arange(n_days * battery_per_day), n_participants) * (86400. / battery_per_day)).astype(np.int64)
+    hours = (offsets % 86400) / 3600.
+    plugged = ((hours >= 23) | (hours < 7)).astype(int) * rng.choice([1, 2], n_readings)
+    level = np.clip(np.where(plugged > 0, 60 + 5 * ((hours + 1) % 24), 100 - 5 * (hours - 7)) + \
+                    rng.normal(0, 3, n_readings), 0, 100).round()
+    df = pd.DataFrame({'participantID': participants[partic], \
+                       'date': _time_strings(start + offsets.astype('timedelta64[s]')), \
+                       'level': level, 'plugged': plugged, \
+                       'temperature': (300 + 20 * rng.rand(n_readings)).round(), \
+                       'voltage': (3700 + 400 * level / 100. + rng.normal(0, 20, n_readings)).round()})
+    df[['participantID', 'date', 'level', 'plugged', 'temperature', 'voltage']].to_csv(os.path.join(data_dir, 'Battery.csv'), index=False)
+    row_counts['Battery.csv'] = n_readings
+
+    ''' Survey: answered the next morning for about 90% of days '''
+    partic, days = np.nonzero(rng.rand(n_participants, n_days) < 0.9)
+    day_mood = mood[partic, days]
+    answers = np.column_stack([rng.randint(4, 10, len(partic)), \
+                               np.clip(np.round(4 + 1.2 * day_mood + rng.normal(0, 0.7, len(partic))), 1, 7), \
+                               np.clip(np.round(4 - 0.8 * day_mood + rng.normal(0, 1, len(partic))), 1, 7), \
+                               np.clip(np.round(4 + 0.6 * day_mood + rng.normal(0, 1, len(partic))), 1, 7)]).astype(int)
+    survey_days = start + days.astype('timedelta64[D]')
+    answer_times = survey_days + np.timedelta64(1, 'D') + rng.randint(8 * 3600, 12 * 3600, len(partic)).astype('timedelta64[s]')
+    questions_raw = '[' + ','.join('"%s"' % question for question in QUESTIONS) + ']'
+    df = pd.DataFrame({'participantID': participants[partic], \
+                       'name': ['Survey ' + day for day in np.datetime_as_string(survey_days.astype('datetime64[D]'))], \
+                       'date': _time_strings(answer_times), 'questions_raw': questions_raw, \
+                       'answers_raw': ['[' + ','.join('"%d"' % answer for answer in row) + ']' for row in answers]})
+    df[['participantID', 'name', 'date', 'questions_raw', 'answers_raw']].to_csv(os.path.join(data_dir, 'SurveyFromPhone.csv'), index=False)
+    row_counts['SurveyFromPhone.csv'] = df.shape[0]
+    return row_counts
@@ -1,14 +1,366 @@
+import os
+import json
+import math
+import inspect
 import numpy as np
 import pandas as pd
-from pandas import Timestamp
 from pandas.tseries.offsets import *
-from datetime import datetime
 from sklearn import cross_validation
 from create_labels import create_poss_labels
-from feature_engineer import FeatureEngineer
+from feature_engineer import FeatureEngineer, BATTERY_EXTRA_COLS
+from data_cache import FrameCache, fingerprint
+from incremental import IncrementalState
+from encoding import Encoder, NAMESPACES, MISSING_CODE
+from rolling_features import rolling_features
+from predictor import new_profile, CENTRALITY_COLS
+from instrumentation import Instrumentation, instrumented
+from sklearn.externals import joblib
 from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import r2_score
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid
 
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
+from multiprocessing import Pool
+
+''' Raw columns each FeatureEngineer path reads, by source; sources not listed keep every column '''
+FEATURE_COLS = {'df_SMSLog': ['participantID.A', 'number.hash', 'type', 'local_time'],
+                'df_CallLog': ['participantID.A', 'number.hash', 'type', 'local_time'],
+                'df_Battery': ['participantID', 'date', 'level', 'plugged', 'temperature', 'voltage'],
+                'df_BluetoothProximity': ['participantID', 'participantID.B', 'address', 'date']}
+''' IDs and hashes, stored as categoricals by the chunked loader '''
+CATEGORICAL_COLS = ['participantID', 'participantID.A', 'participantID.B', 'number.hash', 'address']
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # Format of the raw timestamps
+TIME_COLS = {'df_BluetoothProximity': 'date', 'df_Battery': 'date', 'df_AppRunning': 'scantime'}    # Default: local_time
+DAY_START_HOUR = 4  # A day runs from 4 AM to 4 AM the next day
+BT_MIN_HOUR = 7     # Bluetooth observations before 7 AM are dropped
+CLEANING_VERSION = 4    # Bump whenever _limit_dates_df changes, to invalidate cached cleaned frames
+ENGINEERING_VERSION = 7 # Bump whenever FeatureEngineer changes, to invalidate cached engineered features
+PCA_START_COMPONENTS = 50   # Components first tried by the randomized/incremental PCA solvers for an energy proportion
+
+
+def _engineer_job(job):
+    '''
+    INPUT: tuple of (DataFrame, string, dict, Encoder)
+    OUTPUT: DataFrame, list of dicts
+
+    Runs FeatureEngineer(df, df_name, encoder=encoder, **options).engineer(), returning the
+    engineered df and the run's instrumentation records.
+    Module-level so it can be sent to a multiprocessing Pool.
+    '''
+    df, df_name, options, encoder = job
+    instrumentation = Instrumentation()
+    df_engineered = FeatureEngineer(df, df_name, instrumentation=instrumentation, encoder=encoder, **options).engineer()
+    return df_engineered, instrumentation.records
+
+
+_cv_folds = None   # ModelTester's X, y_all and participant fold lists and fold preprocessors, set by _set_cv_folds
+
+
+def _fold_medians(X_train, partic_train, col_nums):
+    '''
+    INPUT: array, array, list of ints
+    OUTPUT: DataFrame, Series
+
+    Returns each participant's median of columns col_nums over X_train (indexed by participant),
+    and the overall X_train medians, for _fill_medians.
+    '''
+    df_train = pd.DataFrame(X_train[:, col_nums])
+    return df_train.groupby(partic_train).median(), df_train.median()
+
+
+def _fill_medians(X, partic, col_nums, medians, overall_medians):
+    '''
+    INPUT: array, array, list of ints, DataFrame, Series
+    OUTPUT: array
+
+    Returns a copy of X whose missing values in columns col_nums are filled with each
+    participant's median (see _fold_medians). Participants absent from medians get the overall
+    median; columns missing entirely from the training rows are set to 0.
+    '''
+    X = X.copy()
+    fill = medians.reindex(partic).fillna(overall_medians).fillna(0).values
+    block = X[:, col_nums]
+    missing = np.isnan(block)
+    block[missing] = fill[missing]
+    X[:, col_nums] = block
+    return X
+
+
+def _impute_fold_medians(X_train, X_test, partic_train, partic_test, col_nums):
+    '''
+    INPUT: array, array, array, array, list of ints
+    OUTPUT: array, array
+
+    Returns copies of X_train and X_test whose missing values in columns col_nums are filled with
+    each participant's median over X_train (see _fill_medians).
+    '''
+    medians, overall_medians = _fold_medians(X_train, partic_train, col_nums)
+    return _fill_medians(X_train, partic_train, col_nums, medians, overall_medians), \
+           _fill_medians(X_test, partic_test, col_nums, medians, overall_medians)
+
+
+def _fit_pca(X, energy_kept, pca_solver='full'):
+    '''
+    INPUT: array, float, string
+    OUTPUT: fitted PCA or IncrementalPCA
+
+    Fits PCA on X, keeping energy_kept proportion of the energy (variance), or energy_kept
+    components if it is 1 or more. pca_solver 'full' uses an exact SVD; 'randomized' (randomized
+    SVD) and 'incremental' (IncrementalPCA, in batches) are cheaper on wide matrices, such as
+    with de-medianed columns. Those two need a number of components, so for a proportion they fit
+    PCA_START_COMPONENTS components, doubling until energy_kept is reached, and keep the leading
+    components that reach it.
+    '''
+    if pca_solver == 'full':
+        return PCA(n_components=energy_kept).fit(X)
+    if pca_solver not in ('randomized', 'incremental'):
+        raise ValueError("Unknown pca_solver: " + str(pca_solver))
+
+    max_components = min(X.shape)
+    n_components = int(energy_kept) if energy_kept >= 1 else min(PCA_START_COMPONENTS, max_components)
+    while True:
+        if pca_solver == 'randomized':
+            pca = PCA(n_components=n_components, svd_solver='randomized', random_state=0).fit(X)
+        else:
+            pca = IncrementalPCA(n_components=n_components).fit(X)
+        if energy_kept >= 1:
+            return pca
+        cum_energy = np.cumsum(pca.explained_variance_ratio_)
+        if cum_energy[-1] >= energy_kept or n_components == max_components:
+            break
+        n_components = min(2 * n_components, max_components)
+    n_kept = min(int(np.searchsorted(cum_energy, energy_kept)) + 1, n_components)
+    pca.components_ = pca.components_[:n_kept]
+    pca.n_components_ = n_kept
+    return pca
+
+
+class _FoldPreprocessor(object):
+    def __init__(self, median_fill_col_nums, reduce_dimensions, energy_kept, pca_solver):
+        '''
+        INPUT: list of ints, bool, float, string
+        OUTPUT: None
+
+        Class constructor.
+        Preprocessing of one CV fold, fitted on its training rows only: fills columns
+        median_fill_col_nums from training-row participant medians, then, if reduce_dimensions,
+        scales and reduces dimensions with a StandardScaler and PCA (see _fit_pca). Only the fitted
+        medians, scaler and PCA are kept, so folds can be transformed as needed rather than stored.
+        '''
+        self.median_fill_col_nums = median_fill_col_nums
+        self.reduce_dimensions = reduce_dimensions
+        self.energy_kept = energy_kept
+        self.pca_solver = pca_solver
+        self.medians, self.overall_medians, self.scaler, self.pca = None, None, None, None
+
+    def fit(self, X_train, partic_train):
+        '''
+        INPUT: array, array
+        OUTPUT: _FoldPreprocessor
+        '''
+        if self.median_fill_col_nums:
+            self.medians, self.overall_medians = _fold_medians(X_train, partic_train, self.median_fill_col_nums)
+            X_train = _fill_medians(X_train, partic_train, self.median_fill_col_nums, self.medians, self.overall_medians)
+        if self.reduce_dimensions:
+            self.scaler = StandardScaler().fit(X_train)
+            self.pca = _fit_pca(self.scaler.transform(X_train), self.energy_kept, self.pca_solver)
+        return self
+
+    def transform(self, X, partic):
+        '''
+        INPUT: array, array
+        OUTPUT: array
+
+        Returns X (rows of participants partic) preprocessed, ready for fitting or scoring.
+        '''
+        if self.median_fill_col_nums:
+            X = _fill_medians(X, partic, self.median_fill_col_nums, self.medians, self.overall_medians)
+        if self.reduce_dimensions:
+            X = self.pca.transform(self.scaler.transform(X))
+        return X
+
+
+def _preprocess_fold(job):
+    '''
+    INPUT: tuple of (int, list of ints, bool, float, string)
+    OUTPUT: _FoldPreprocessor, list of dicts
+
+    Returns fold i's _FoldPreprocessor, fitted on its training rows, and instrumentation records.
+    Reads the raw folds from _cv_folds.
+    Module-level so it can be sent to a multiprocessing Pool.
+    '''
+    i, median_fill_col_nums, reduce_dimensions, energy_kept, pca_solver = job
+    X_train_folds, _, _, _, partic_train_folds, _, _ = _cv_folds
+    instrumentation = Instrumentation()
+    X_train = X_train_folds[i]
+    with instrumentation.stage('preprocess fold', X_train, fold=i):
+        preprocessor = _FoldPreprocessor(median_fill_col_nums, reduce_dimensions, energy_kept, pca_solver)
+        preprocessor.fit(X_train, partic_train_folds[i])
+    return preprocessor, instrumentation.records
+
+
+def _holdout_start(partic, holdout_fraction):
+    '''
+    INPUT: array, float
+    OUTPUT: int
+
+    Returns the row at which to split a training fold's holdout off from its end, given the
+    fold's participants partic (grouped, as the feature-label matrix is sorted by participant):
+    the participant boundary nearest to holding out holdout_fraction of the rows, so the holdout
+    is made of whole participants. Keeps at least one participant on either side; with a single
+    participant, cuts at holdout_fraction (at least one row).
+    '''
+    n_rows = len(partic)
+    target = n_rows - max(1, int(round(holdout_fraction * n_rows)))
+    boundaries = np.flatnonzero(partic[1:] != partic[:-1]) + 1
+    if len(boundaries) == 0:
+        return target
+    return int(boundaries[np.argmin(np.abs(boundaries - target))])
+
+
+class _HoldoutMonitor(object):
+    def __init__(self, X_holdout, y_holdout, early_stopping_rounds=None):
+        '''
+        INPUT: array, array, int
+            - early_stopping_rounds: if set, stop fitting once the holdout R^2 hasn't improved for
+                                     this many iterations
+        OUTPUT: None
+
+        Class constructor.
+        Tracks a boosting model's R^2 on a held-out slice of its training rows after every
+        iteration. Passed as the monitor argument of fit (GradientBoosting models), it scores each
+        iteration as it is fitted, from one staged_predict pass that advances a stage at a time,
+        and stops the fit early; otherwise call score_all after fitting.
+        '''
+        self.X_holdout = X_holdout
+        self.y_holdout = y_holdout
+        self.early_stopping_rounds = early_stopping_rounds
+        self.scores = []
+        self.stages = None
+
+    def __call__(self, i, model, fit_locals):
+        if self.stages is None:
+            self.stages = model.staged_predict(self.X_holdout)
+        self.scores.append(r2_score(self.y_holdout, next(self.stages)))
+        return self.early_stopping_rounds is not None and i - self.best_iteration() >= self.early_stopping_rounds
+
+    def score_all(self, model):
+        '''
+        INPUT: fitted model
+        OUTPUT: None
+        '''
+        self.scores = [r2_score(self.y_holdout, y_pred) for y_pred in model.staged_predict(self.X_holdout)]
+
+    def best_iteration(self):
+        '''
+        INPUT: None
+        OUTPUT: int
+
+        Returns the (0-based) iteration with the best holdout R^2.
+        '''
+        return int(np.argmax(self.scores))
+
+
+def _fit_score_job(job):
+    '''
+    INPUT: tuple of (model, int, int, bool, tuple or None)
+    OUTPUT: float, array (or None), dict (or None), list of dicts
+
+    Fits a (cloned) model on fold i for the label in column poss_label_col_num and returns its R^2
+    on the test fold, along with its feature importances (None if reducing dimensions or if the
+    model doesn't provide them), its staged results (see below) and instrumentation records
+    of the preprocess, fit and score steps. Reads the raw folds and their fitted preprocessors (see
+    ModelTester._set_cv_folds) from _cv_folds, which forked Pool workers inherit without copying,
+    and preprocesses fold i only for the duration of the job.
+
+    If staged_options, a (holdout_fraction, early_stopping_rounds) tuple, is set and the model has
+    staged_predict (boosting models), also returns the test R^2 after every iteration, all from
+    one fit, as staged results {'test_scores': array, 'holdout_best': int or None}. If
+    holdout_fraction is set, about that share of training rows (the last whole participants; see
+    _holdout_start) is held out of the fit, the returned R^2 is the test R^2 at the iteration
+    that did best on the holdout (holdout_best, 0-based), and fits that support a monitor stop
+    early_stopping_rounds iterations after the holdout R^2 last improved.
+    Module-level so it can be sent to a multiprocessing Pool.
+    '''
+    model, i, poss_label_col_num, reduce_dimensions, staged_options = job
+    X_train_folds, X_test_folds, y_all_train_folds, y_all_test_folds, partic_train_folds, partic_test_folds, \
+        fold_preprocessors = _cv_folds
+    instrumentation = Instrumentation()
+    X_train, X_test = X_train_folds[i], X_test_folds[i]
+    if fold_preprocessors is not None:
+        with instrumentation.stage('preprocess', X_train) as stage:
+            X_train = fold_preprocessors[i].transform(X_train, partic_train_folds[i])
+            X_test = fold_preprocessors[i].transform(X_test, partic_test_folds[i])
+            stage.output(X_train)
+    y_train = y_all_train_folds[i][:, poss_label_col_num]
+    y_test = y_all_test_folds[i][:, poss_label_col_num]
+
+    staged = staged_options is not None and hasattr(model, 'staged_predict')
+    monitor, fit_params = None, {}
+    if staged and staged_options[0]:
+        holdout_fraction, early_stopping_rounds = staged_options
+        start = _holdout_start(partic_train_folds[i], holdout_fraction)
+        monitor = _HoldoutMonitor(X_train[start:], y_train[start:], early_stopping_rounds)
+        X_train, y_train = X_train[:start], y_train[:start]
+        if 'monitor' in inspect.getargspec(model.fit).args:
+            fit_params['monitor'] = monitor
+
+    with instrumentation.stage('fit', X_train):
+        model.fit(X_train, y_train, **fit_params)
+    with instrumentation.stage('score', X_test):
+        staged_results = None
+        if staged:
+            test_scores = np.array([r2_score(y_test, y_pred) for y_pred in model.staged_predict(X_test)])
+            staged_results = {'test_scores': test_scores, 'holdout_best': None}
+            if monitor is not None:
+                if 'monitor' not in fit_params:
+                    monitor.score_all(model)
+                staged_results['holdout_best'] = min(monitor.best_iteration(), len(test_scores) - 1)
+                score = test_scores[staged_results['holdout_best']]
+            else:
+                score = test_scores[-1]
+        else:
+            score = model.score(X_test, y_test)
+    feature_importances = None if reduce_dimensions else getattr(model, 'feature_importances_', None)
+    return score, feature_importances, staged_results, instrumentation.records
+
+
+class FoldArrays(object):
+    def __init__(self, arr, indexers):
+        '''
+        INPUT: array, list of slices and/or index arrays
+        OUTPUT: None
+
+        Class constructor.
+        A list-like of the folds of arr, one per indexer. Folds are only materialized when accessed:
+        slices (contiguous rows) give views of arr, index arrays give copies.
+        '''
+        self.arr = arr
+        self.indexers = indexers
+
+    def __len__(self):
+        return len(self.indexers)
+
+    def __getitem__(self, i):
+        return self.arr[self.indexers[i]]
+
+    def __iter__(self):
+        for indexer in self.indexers:
+            yield self.arr[indexer]
+
+
+def _as_indexer(index):
+    '''
+    INPUT: array
+    OUTPUT: slice or array
+
+    Returns a slice equivalent to the sorted row index array index if it covers a contiguous
+    range, and index itself otherwise.
+    '''
+    if len(index) > 0 and index[-1] - index[0] == len(index) - 1:
+        return slice(index[0], index[-1] + 1)
+    return index
 
 
 class ModelTester(object):
@@ -16,7 +368,11 @@ class ModelTester(object):
                  advanced_call_sms_bt_features=True, add_centrality_chars=True, \
                  reduce_dimensions=False, very_cutoff_inclusive=6, \
                  very_un_cutoff_inclusive=2, min_date='2010-11-12', max_date='2011-05-21', \
-                 create_demedianed=False, Fri_weekend=True, keep_dow=True):
+                 create_demedianed=False, Fri_weekend=True, keep_dow=True, chunksize=None, \
+                 cache_dir=None, feature_cache_dir=None, feature_cache_max_mb=1024, \
+                 n_jobs=1, train_only_medians=False, state_dir=None, centrality_window_days=None, \
+                 rolling_windows=None, battery_stats=None, data_dir='../data/', instrumentation_callback=None, \
+                 pca_solver='full'):
         '''
         INPUT:
             - feature_text_files: list of strings--CSV files containing features data
@@ -32,71 +388,203 @@ class ModelTester(object):
             - create_demedianed: whether to create "de-medianed" (by participant) feature columns
             - Fri_weekend: whether to consider Friday part of the weekend for the weekend dummy.
             - keep_dow: whether to keep dow (day of week) as a feature.
+            - chunksize: if set, streams each CSV in chunks of this many rows, limiting dates and
+                         dropping unused columns chunk by chunk (see _read_chunked).
+            - cache_dir: if set, cleaned, date-limited feature dfs are cached here (see _read_cached)
+                         and reused by later runs whose files and cleaning parameters are unchanged.
+            - feature_cache_dir: if set, each FeatureEngineer output is cached here, keyed by the
+                                 contents of its input df and its options (see _engineer).
+            - feature_cache_max_mb: size cap for feature_cache_dir; least recently used entries go first.
+            - n_jobs: number of worker processes for independent jobs (FeatureEngineer runs, CV fits).
+            - train_only_medians: whether to fill missing Battery/Bluetooth values with participant
+                                  medians from each fold's training rows only, rather than all rows.
+            - state_dir: if set, running aggregates of the logs are kept here (see IncrementalState),
+                         so new days of logs can be added with update_feature_label_mat.
+            - centrality_window_days: if set (and add_centrality_chars), also adds centrality measures
+                                      over the trailing window of this many days, for each date.
+            - rolling_windows: if set, list of window lengths in days (e.g., [3, 7, 14]); adds trailing
+                               aggregates of the basic SMS/Call/Bluetooth/Battery features over each
+                               (see _add_rolling_blocks).
+            - battery_stats: extra battery statistics to engineer (see FeatureEngineer.engineer_battery):
+                             any of 'std', 'hours_plugged', 'discharge_rate'. Not available from
+                             incremental_state, so rows updated by update_feature_label_mat leave them missing.
+            - data_dir: directory containing feature_text_files and SurveyFromPhone.csv.
+            - instrumentation_callback: if set, called with the record (a dict) of each pipeline stage
+                                        as it ends. Records are also kept in instrumentation; save
+                                        them with instrumentation.report(path).
+            - pca_solver: if reduce_dimensions, how PCA is fitted (see _fit_pca): 'full', or
+                          'randomized' or 'incremental' for wide (e.g., de-medianed) matrices.
         OUTPUT: None
 
         Class constructor.
         Creates all labels, each of which the model will individually attempt to predict.
         Reads CSV files specified by feature_text_files as DataFrames.
         '''
+        self.instrumentation = Instrumentation(instrumentation_callback)  # Time, memory and shape of each stage
+        stage = self.instrumentation.stage
         self.poss_labels = poss_labels
         self.basic_features = basic_features
         self.advanced_call_sms_bt_features = advanced_call_sms_bt_features
         self.add_centrality_chars = add_centrality_chars
+        self.centrality_window_days = centrality_window_days
+        self.rolling_windows = rolling_windows
+        self.battery_stats = battery_stats
         self.reduce_dimensions = reduce_dimensions
+        self.pca_solver = pca_solver
         self.min_date = min_date
         self.max_date = max_date
         self.create_demedianed = create_demedianed
         self.Fri_weekend = Fri_weekend
         self.keep_dow = keep_dow
+        self.chunksize = chunksize
+        self.n_jobs = n_jobs
+        self.train_only_medians = train_only_medians
+        self.median_fill_cols = []     # Columns left missing for per-fold median imputation
+        self.partic_median_cols = []   # Columns whose missing values are filled with participant medians
+        self.block_coverage = {}       # df_name --> rows and share of label rows covered, per feature block
+        self.incremental_state = IncrementalState(state_dir) if state_dir else None
+        self.encoder = Encoder(state_dir)  # Int32 codes of IDs and hashes; decode with self.encoder.decode
+        self.frame_cache = FrameCache(cache_dir) if cache_dir else None
+        self.feature_cache = None
+        if feature_cache_dir:
+            self.feature_cache = FrameCache(feature_cache_dir, max_bytes=feature_cache_max_mb * 1024 ** 2)
 
         self.feature_dfs = {}
+        self.dates_limited = set()     # Names of feature_dfs already passed through _limit_dates_df
+        self.limit_dates_counts = {}   # df_name --> rows read and kept by _limit_dates_df (not kept for cache hits)
         self.feature_dfs_forflmat = {}  # Fully cleaned and engineered; ready for feat-lab mat
-        self.df_labels = create_poss_labels('SurveyFromPhone.csv', poss_labels, to_dummyize, \
-                                            very_cutoff_inclusive, very_un_cutoff_inclusive)
+        self.label_drop_counts = {}    # Reason --> number of survey rows dropped while creating labels
+        with stage('create_poss_labels') as labels_stage:
+            self.df_labels = create_poss_labels('SurveyFromPhone.csv', poss_labels, to_dummyize, \
+                                                very_cutoff_inclusive, very_un_cutoff_inclusive, \
+                                                drop_counts=self.label_drop_counts, data_dir=data_dir)
+            labels_stage.output(self.df_labels)
         print "Labels created"
         self.feature_label_mat = None
         self.models = {}
         self.X_train_folds, self.X_test_folds, self.y_all_train_folds, self.y_all_test_folds = [], [], [], []
         self.n_folds = None
+        self.partic_train_folds, self.partic_test_folds = [], []
+        self.fold_preprocessors = {}   # (energy_kept, pca_solver) --> each fold's fitted _FoldPreprocessor
         self.features_used = None
         self.feature_importances = []
+        self.staged_results = {}       # (model description, label) --> staged R^2 curve and best iteration
 
         ''' Reads in raw feature_dfs'''
         for text_file in feature_text_files:
-            input_name = '../data/' + text_file
+            input_name = data_dir + text_file
             df_name = "df_" + text_file.split('.')[0]
-            self.feature_dfs[df_name] = pd.read_csv(input_name)
+            with stage('read ' + df_name) as read_stage:
+                if self.frame_cache:
+                    self.feature_dfs[df_name] = self._read_cached(input_name, df_name)
+                    self.dates_limited.add(df_name)
+                elif self.chunksize:
+                    self.feature_dfs[df_name] = self._read_chunked(input_name, df_name)
+                    self.dates_limited.add(df_name)
+                else:
+                    self.feature_dfs[df_name] = pd.read_csv(input_name)
+                read_stage.output(self.feature_dfs[df_name])
         print "Feature dfs read in"
 
+    def _read_cached(self, input_name, df_name):
+        '''
+        INPUT: string, string
+        OUTPUT: DataFrame
+
+        Returns the cleaned, date-limited version of a CSV file from frame_cache, keyed by the
+        file's path, mtime and size plus the cleaning parameters. On a miss, reads and cleans the
+        file (chunked if chunksize is set) and stores the result.
+        '''
+        key = self.frame_cache.key(input_name, df_name=df_name, min_date=self.min_date, \
+                                   max_date=self.max_date, chunked=bool(self.chunksize), \
+                                   cleaning_version=CLEANING_VERSION)
+        df = self.frame_cache.load(key)
+        if df is None:
+            if self.chunksize:
+                df = self._read_chunked(input_name, df_name)
+            else:
+                df = self._limit_dates_df(df_name, pd.read_csv(input_name))
+            self.frame_cache.save(key, df)
+            print df_name, "cleaned and cached"
+        return df
+
+    def _read_chunked(self, input_name, df_name):
+        '''
+        INPUT: string, string
+        OUTPUT: DataFrame
+
+        Reads a CSV file chunksize rows at a time, keeping only the columns listed in FEATURE_COLS
+        and limiting each chunk to [min_date, max_date] before it is kept, so peak memory tracks
+        the filtered data rather than the raw file. IDs and hashes are stored as categoricals
+        (_encode later replaces them with int32 codes, before any feature engineering).
+        '''
+        chunks = []
+        for chunk in pd.read_csv(input_name, usecols=FEATURE_COLS.get(df_name), chunksize=self.chunksize):
+            chunks.append(self._limit_dates_df(df_name, chunk))
+        df = pd.concat(chunks, ignore_index=True)
+        for col in CATEGORICAL_COLS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+        return df
+
+    def _limit_dates_df(self, df_name, df):
+        '''
+        INPUT: string, DataFrame
+        OUTPUT: DataFrame
+
+        Keeps observations of a single feature df within [min_date, max_date], inclusive (where a
+        day is defined as 4 AM to 4 AM the next day). Does other minimal cleaning.
+        Timestamps are parsed once (with TIME_FORMAT where it matches); the day is the timestamp
+        less 4 hours, floored to the day, and every filter is a datetime64 comparison in one pass.
+        Adds the rows read and kept to limit_dates_counts[df_name].
+        '''
+        time_col = TIME_COLS.get(df_name, 'local_time')
+        try:
+            local_time = pd.to_datetime(df[time_col], format=TIME_FORMAT).values
+        except ValueError:
+            local_time = pd.to_datetime(df[time_col]).values
+        days = (local_time - np.timedelta64(DAY_START_HOUR, 'h')).astype('datetime64[D]')
+        keep = (days >= np.datetime64(self.min_date, 'D')) & (days <= np.datetime64(self.max_date, 'D'))
+        if df_name == 'df_BluetoothProximity':
+            ''' Removes possibly erroneous nighttime observations, per Friends and Family paper (8.2.1) '''
+            keep &= (local_time - local_time.astype('datetime64[D]')) >= np.timedelta64(BT_MIN_HOUR, 'h')
+
+        df = df.drop(time_col, axis=1)[keep]
+        df['date'] = days[keep].astype('datetime64[ns]')
+        if df_name == 'df_Battery':     # Kept for the time-based battery stats
+            df['local_time'] = local_time[keep]
+        counts = self.limit_dates_counts.setdefault(df_name, {'rows_before': 0, 'rows_after': 0})
+        counts['rows_before'] += len(keep)
+        counts['rows_after'] += int(keep.sum())
+        return df
+
     def _limit_dates(self):
         '''
         INPUT: None
         OUTPUT: None
 
-        Keeps observations within [min_date, max_date], inclusive (where a day is defined as 4 AM to 4 AM the next day).
-        Does other minimal cleaning.
+        Applies _limit_dates_df to every feature df not already limited when read in.
         '''
-
         for df_name in self.feature_dfs.iterkeys():
-            df = self.feature_dfs[df_name]
-            if df_name == 'df_BluetoothProximity':
-                ''' Limits dates to relevant period; removes possibly erroneous nighttime observations'''
-                df = df.rename(columns={'date': 'local_time'})
-                df['local_time'] = pd.DatetimeIndex(pd.to_datetime(df['local_time']))
-                df = df[df['local_time'].dt.hour >= 7] # Per Friends and Family paper (8.2.1), removes b/n midnight and 7 AM
-            elif df_name == 'df_Battery':
-                df = df.rename(columns={'date': 'local_time'})
-            elif df_name == 'df_AppRunning':
-                df = df.rename(columns={'scantime': 'local_time'})
-
-            df['local_time'] = pd.DatetimeIndex(pd.to_datetime(df['local_time']))
-            df.loc[df['local_time'].dt.hour < 4, 'local_time'] = (pd.DatetimeIndex(df[df['local_time'].dt.hour < 4]['local_time']) - \
-                                                                 DateOffset(1))
-            df['date'] = df['local_time'].dt.date
-            df = df.drop('local_time', axis=1)
-            df = df[((df['date'] >= datetime.date(pd.to_datetime(self.min_date))) & \
-                     (df['date'] <= datetime.date(pd.to_datetime(self.max_date))))]
-            self.feature_dfs[df_name] = df
+            if df_name not in self.dates_limited:
+                with self.instrumentation.stage('_limit_dates ' + df_name, self.feature_dfs[df_name]) as stage:
+                    self.feature_dfs[df_name] = self._limit_dates_df(df_name, self.feature_dfs[df_name])
+                    stage.output(self.feature_dfs[df_name])
+                self.dates_limited.add(df_name)
+
+    def _encode(self):
+        '''
+        INPUT: None
+        OUTPUT: None
+
+        Replaces participant IDs, phone-number hashes and Bluetooth addresses in every feature df
+        (plain or, from _read_chunked, categorical) and in df_labels with int32 codes (see Encoder),
+        from here through feature_label_mat.
+        '''
+        for df_name in self.feature_dfs.keys():
+            self.feature_dfs[df_name] = self.encoder.encode(self.feature_dfs[df_name])
+        self.df_labels = self.encoder.encode(self.df_labels)
+        self.encoder.save()
 
     def _fill_na(self):
         '''
@@ -104,48 +592,43 @@ class ModelTester(object):
         OUTPUT: None
 
         Fills in missing values: according to fillna_dict, sets to 0 or to each participant's median value.
+        If train_only_medians, the participant-median columns are left missing and recorded in
+        median_fill_cols, to be filled fold by fold from training rows only (see _impute_fold_medians).
         '''
 
         fillna_dict = {'df_CallLog': 'zero', 'df_SMSLog': 'zero', 'df_network': 'zero', \
                        'df_Battery': 'partic_median', 'df_BluetoothProximity': 'partic_median'}
+        self.median_fill_cols = []
+        self.partic_median_cols = []
 
         for df_name in self.feature_dfs_forflmat.keys():
-            cols = list(self.feature_dfs_forflmat[df_name].columns.values)
-            for to_remove in ['index', 'cnt']:
-                if cols.count(to_remove) > 0:
-                    cols.remove(to_remove)
+            cols = [col for col in self.feature_dfs_forflmat[df_name].columns \
+                    if col not in ('index', 'cnt', 'participantID', 'date')]
             df_name_orig = '_'.join(df_name.split('_')[:2])  # Strips off 'advanced' where applicable
             if fillna_dict[df_name_orig] == 'zero':
-                cols.remove('participantID')
-                cols.remove('date')
-                for col in cols:
-                    self.feature_label_mat[col].fillna(0, inplace=True)
+                self.feature_label_mat[cols] = self.feature_label_mat[cols].fillna(0)
             elif fillna_dict[df_name_orig] == 'partic_median':
-                for col in cols:
-                    if (col != 'date' and col != 'participantID'):
-                        median_dict = dict(self.feature_label_mat.groupby('participantID')[col].median())
-                        self.feature_label_mat.loc[pd.isnull(self.feature_label_mat[col]), col] = \
-                                                            self.feature_label_mat[col].map(median_dict)
+                self.partic_median_cols += cols
+                if self.train_only_medians:
+                    self.median_fill_cols += cols
+                    continue
+                medians = self.feature_label_mat.groupby('participantID')[cols].transform('median')
+                self.feature_label_mat[cols] = self.feature_label_mat[cols].fillna(medians)
 
     def _create_demedianed_cols(self):
         '''
         INPUT: None
         OUTPUT: None
         Creates new "de-medianed" feature columns using each participant's median for each existing
+        feature column, computed in one grouped transform and added as a single block.
         '''
-        all_cols = list(self.feature_label_mat.columns.values)
         cols_to_remove = self.poss_labels + ['participantID', 'date']
-        for col in cols_to_remove:
-            all_cols.remove(col)
-        feature_cols = all_cols
-
-        for col in feature_cols:
-            new_col_name = col + "_demedianed"
-            df_median_by_partic = pd.DataFrame(self.feature_label_mat.groupby('participantID')[col].median()).reset_index()
-            df_median_by_partic.rename(columns={col: 'median'}, inplace=True)
-            median_series = self.feature_label_mat.merge(df_median_by_partic, how='left', on='participantID')['median']
-            self.feature_label_mat[new_col_name] = median_series
-            self.feature_label_mat[new_col_name] = self.feature_label_mat[col] - self.feature_label_mat[new_col_name]
+        feature_cols = [col for col in self.feature_label_mat.columns if col not in cols_to_remove]
+
+        features = self.feature_label_mat[feature_cols]
+        df_demedianed = features - features.groupby(self.feature_label_mat['participantID']).transform('median')
+        df_demedianed.columns = [col + "_demedianed" for col in feature_cols]
+        self.feature_label_mat = pd.concat([self.feature_label_mat, df_demedianed], axis=1)
 
     def _add_weekend_col(self):
         '''
@@ -162,38 +645,200 @@ class ModelTester(object):
         if not self.keep_dow:
             self.feature_label_mat.drop('day_of_week', axis=1, inplace=True)
 
+    def _map(self, func, jobs):
+        '''
+        INPUT: function, list
+        OUTPUT: list
+
+        Returns [func(job) for job in jobs], in order. Runs in a pool of n_jobs processes when
+        n_jobs > 1, so func must be a module-level function and jobs must be picklable.
+        '''
+        if self.n_jobs > 1 and len(jobs) > 1:
+            pool = Pool(min(self.n_jobs, len(jobs)))
+            try:
+                return pool.map(func, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        return [func(job) for job in jobs]
+
+    def _engineer_jobs(self):
+        '''
+        INPUT: None
+        OUTPUT: list of (string, tuple)
+
+        Returns the FeatureEngineer jobs (see _engineer_job) for every feature df, each with the
+        name of the feature_dfs_forflmat block it produces, in a deterministic order.
+        '''
+        to_engineer = []
+        for df_name in sorted(self.feature_dfs.keys()):
+            df = self.feature_dfs[df_name]
+            if self.advanced_call_sms_bt_features:   # Available for CallLog, SMSLog, BluetoothProximity
+                if (df_name == 'df_CallLog' or df_name == 'df_SMSLog' or df_name == 'df_BluetoothProximity'):
+                    df_for_adv = df.copy()
+                    if df_name == 'df_BluetoothProximity':
+                        df_for_adv = df_for_adv[df_for_adv['participantID.B'] != MISSING_CODE]
+                    add_centrality_chars = self.add_centrality_chars and df_name == 'df_BluetoothProximity'
+                    options = {'advanced': True, 'add_centrality_chars': add_centrality_chars, \
+                               'centrality_window_days': self.centrality_window_days if add_centrality_chars else None}
+                    to_engineer.append((df_name + '_advanced', (df_for_adv, df_name, options, self.encoder)))
+            if self.basic_features:
+                options = {'battery_stats': self.battery_stats} if df_name == 'df_Battery' else {}
+                to_engineer.append((df_name, (df, df_name, options, self.encoder)))
+        return to_engineer
+
+    def _engineer_all(self):
+        '''
+        INPUT: None
+        OUTPUT: None
+
+        Engineers basic and/or advanced features for every feature df, saving each result to
+        feature_dfs_forflmat. Results found in feature_cache (if set) are reused; the rest are
+        independent FeatureEngineer jobs, run in a pool of n_jobs processes when n_jobs > 1, whose
+        instrumentation records are added to instrumentation (their wall times overlap if n_jobs > 1).
+        '''
+        jobs, job_names, cache_keys = [], [], []
+        fingerprints = {}
+        encoding = self.encoder.fingerprint() if self.feature_cache else None
+        for df_newname, job in self._engineer_jobs():
+            key = None
+            if self.feature_cache:
+                df_name = job[1]
+                if df_name not in fingerprints:
+                    fingerprints[df_name] = fingerprint(self.feature_dfs[df_name])
+                key = self.feature_cache.content_key(df_fingerprint=fingerprints[df_name], df_name=df_name, \
+                                                     min_date=self.min_date, max_date=self.max_date, \
+                                                     engineering_version=ENGINEERING_VERSION, \
+                                                     encoding=encoding, **job[2])
+                with self.instrumentation.stage('load cached ' + df_newname) as stage:
+                    df_engineered = self.feature_cache.load(key)
+                    stage.output(df_engineered)
+                if df_engineered is not None:
+                    self.feature_dfs_forflmat[df_newname] = df_engineered
+                    print "ModelTester: Loaded " + df_newname + " features from cache"
+                    continue
+            jobs.append(job)
+            job_names.append(df_newname)
+            cache_keys.append(key)
+
+        results = self._map(_engineer_job, jobs)
+
+        for df_newname, key, (df_engineered, records) in zip(job_names, cache_keys, results):
+            self.instrumentation.add(records)
+            if key is not None:
+                self.feature_cache.save(key, df_engineered)
+            self.feature_dfs_forflmat[df_newname] = df_engineered
+            print "ModelTester: Engineered " + df_newname + "\n"
+
+    def _add_rolling_blocks(self):
+        '''
+        INPUT: None
+        OUTPUT: None
+
+        For each basic SMS/Call/Bluetooth/Battery block in feature_dfs_forflmat, adds a
+        [df_name]_rolling block of trailing aggregates over each of rolling_windows, evaluated at
+        every label (participantID, date): per-day means of event counts, and means of the
+        observed daily battery stats. Recomputed in full each time, as it is a single linear pass.
+        '''
+        if not self.rolling_windows:
+            return
+        df_keys = self.df_labels[['participantID', 'date']].dropna().drop_duplicates()
+        for df_name in ['df_SMSLog', 'df_CallLog', 'df_BluetoothProximity', 'df_Battery']:
+            if df_name not in self.feature_dfs_forflmat:
+                continue
+            df = self.feature_dfs_forflmat[df_name]
+            cols = [col for col in df.columns if col not in ('index', 'cnt', 'participantID', 'date') \
+                    and df[col].dtype.kind in 'biuf']
+            self.feature_dfs_forflmat[df_name + '_rolling'] = rolling_features(df, df_keys, cols, \
+                                                                self.rolling_windows, per_day=(df_name != 'df_Battery'))
+
+    def _join_key(self, df, participants):
+        '''
+        INPUT: DataFrame, Index
+        OUTPUT: array, array
+
+        Returns integer join keys for df's rows: participant codes (positions in participants,
+        -1 if absent) and day ordinals (days since the epoch).
+        '''
+        partic_codes = pd.Categorical(np.asarray(df['participantID']), categories=participants).codes
+        day_ordinals = pd.DatetimeIndex(df['date']).values.astype('datetime64[D]').astype(np.int64)
+        return partic_codes, day_ordinals
+
+    def _join_features(self, df_labels=None):
+        '''
+        INPUT: DataFrame
+            - df_labels: labels to join onto; defaults to self.df_labels
+        OUTPUT: DataFrame
+
+        Left-joins every df in feature_dfs_forflmat onto df_labels in a single pass: each block is
+        indexed on a shared (participant code, day ordinal) key, the blocks are aligned with one
+        concat, and the result is joined onto the labels once. Saves each block's row count and the
+        share of label rows it covers to block_coverage.
+        '''
+        if df_labels is None:
+            df_labels = self.df_labels
+        participants = pd.Index(df_labels['participantID'].dropna().unique())
+        blocks = []
+        for df_name in sorted(self.feature_dfs_forflmat.keys()):    # Sorted so column order is deterministic
+            feature_df = self.feature_dfs_forflmat[df_name]
+            partic_codes, day_ordinals = self._join_key(feature_df, participants)
+            block = feature_df.drop(['participantID', 'date'], axis=1)
+            block.index = pd.MultiIndex.from_arrays([partic_codes, day_ordinals], names=['_partic_code', '_day'])
+            block = block[partic_codes >= 0]
+            blocks.append((df_name, block[~block.index.duplicated()]))
+
+        df_labels = df_labels.copy()
+        df_labels['_partic_code'], df_labels['_day'] = self._join_key(df_labels, participants)
+        features = pd.concat([block for _, block in blocks], axis=1)
+        feature_label_mat = df_labels.join(features, on=['_partic_code', '_day'])
+
+        ''' Coverage report '''
+        self.block_coverage = {}
+        for df_name, block in blocks:
+            covered = feature_label_mat[list(block.columns)].notnull().any(axis=1).mean()
+            self.block_coverage[df_name] = {'rows': block.shape[0], 'label_rows_covered': covered}
+            print "ModelTester: %s covers %.1f%% of label rows (%d rows)" % (df_name, 100 * covered, block.shape[0])
+
+        return feature_label_mat.drop(['_partic_code', '_day'], axis=1)
+
+    @instrumented('feature_label_mat')
     def create_feature_label_mat(self):
         '''
         INPUT: None
         OUTPUT: None
         Creates a feature-matrix DataFrame, and deals with missing values.
         '''
+        stage = self.instrumentation.stage
         self._limit_dates()
+        with stage('_encode'):
+            self._encode()
+        if self.incremental_state:
+            with stage('IncrementalState.rebuild'):
+                self.incremental_state.rebuild(self.feature_dfs)
         ''' Engineers features'''
-        for df_name, df in self.feature_dfs.items():
-            if self.advanced_call_sms_bt_features:
-                df_for_adv = df.copy()
-                if df_name == 'df_BluetoothProximity':
-                    df_for_adv = df_for_adv[pd.notnull(df_for_adv['participantID.B'])]
-            if self.basic_features:
-                fe = FeatureEngineer(df, df_name)
-                self.feature_dfs_forflmat[df_name] = fe.engineer()
-            if self.advanced_call_sms_bt_features:   # Available for CallLog, SMSLog, BluetoothProximity
-                if (df_name == 'df_CallLog' or df_name == 'df_SMSLog' or df_name == 'df_BluetoothProximity'):
-                    if self.add_centrality_chars and df_name == 'df_BluetoothProximity':
-                        fe = FeatureEngineer(df_for_adv, df_name, advanced=True, add_centrality_chars=True)
-                    else:
-                        fe = FeatureEngineer(df_for_adv, df_name, advanced=True)
-                    df_newname = df_name + '_advanced'
-                    self.feature_dfs_forflmat[df_newname] = fe.engineer().drop(['index', 'cnt'], axis=1)
-            print "ModelTester: Engineered basic and/or advanced for " + df_name + "\n"
-
+        with stage('_engineer_all'):
+            self._engineer_all()
+        for df_name in self.feature_dfs_forflmat.keys():
+            if df_name.endswith('_advanced'):
+                self.feature_dfs_forflmat[df_name] = self.feature_dfs_forflmat[df_name].drop(['index', 'cnt'], axis=1)
+        with stage('_add_rolling_blocks'):
+            self._add_rolling_blocks()
 
         ''' Merges features and labels into one DataFrame'''
-        for feature_df in self.feature_dfs_forflmat.itervalues():
-            self.df_labels = self.df_labels.merge(feature_df, how='left', on=['participantID', 'date'])
-        self.feature_label_mat = self.df_labels
+        with stage('_join_features', self.df_labels) as join_stage:
+            self.feature_label_mat = self._join_features()
+            join_stage.output(self.feature_label_mat)
+        with stage('_finish_feature_label_mat', self.feature_label_mat) as finish_stage:
+            self._finish_feature_label_mat()
+            finish_stage.output(self.feature_label_mat)
 
+    def _finish_feature_label_mat(self):
+        '''
+        INPUT: None
+        OUTPUT: None
+        Deals with missing values in the freshly joined feature_label_mat and adds the de-medianed
+        and weekend columns. Every step works participant by participant or row by row.
+        '''
         self.feature_label_mat = self.feature_label_mat[pd.notnull(self.feature_label_mat['participantID'])]
         self._fill_na()
 
@@ -202,7 +847,8 @@ class ModelTester(object):
 
         if self.create_demedianed:
             self._create_demedianed_cols()
-        self.feature_label_mat.fillna(0, inplace=True)
+        other_cols = [col for col in self.feature_label_mat.columns if col not in self.median_fill_cols]
+        self.feature_label_mat[other_cols] = self.feature_label_mat[other_cols].fillna(0)
 
         ''' Adds a dummy 'weekend', 1 for Sat/Sun (and Fri if Fri_weekend=True), 0 otherwise '''
         self._add_weekend_col()
@@ -210,14 +856,114 @@ class ModelTester(object):
         if list(self.feature_label_mat.columns).count('index') > 0:    #Drops 'index' column if it exists
             self.feature_label_mat.drop('index', axis=1, inplace=True)
 
+    def _replace_rows(self, block_name, df_new_rows, participants=None, df_keys=None):
+        '''
+        INPUT: string, DataFrame, set, DataFrame
+        OUTPUT: None
+
+        Replaces the rows of feature_dfs_forflmat[block_name] belonging to participants (or, if
+        df_keys is given instead, to those (participantID, date) pairs) with df_new_rows.
+        '''
+        df_old = self.feature_dfs_forflmat[block_name]
+        if df_keys is None:
+            stale = df_old['participantID'].isin(participants).values
+        else:
+            all_partics = pd.Index(pd.concat([df_old['participantID'], df_keys['participantID']]).astype(object).unique())
+            old_codes, old_days = self._join_key(df_old, all_partics)
+            key_codes, key_days = self._join_key(df_keys, all_partics)
+            n_days = max(old_days.max(), key_days.max()) + 1
+            stale = np.in1d(old_codes.astype(np.int64) * n_days + old_days, key_codes.astype(np.int64) * n_days + key_days)
+        self.feature_dfs_forflmat[block_name] = pd.concat([df_old[~stale], df_new_rows], ignore_index=True)
+
+    def _update_blocks(self, df_name, df_keys, participants):
+        '''
+        INPUT: string, DataFrame, set
+        OUTPUT: None
+
+        Recomputes, from incremental_state, the rows of df_name's feature blocks affected by new data:
+            - basic features: only the (participantID, date) pairs in df_keys
+            - advanced features: the participants whose whole-study aggregates changed (all
+              participants when Bluetooth centrality is on, since it is a whole-network measure)
+        '''
+        state = self.incremental_state
+        if df_name in self.feature_dfs_forflmat:
+            if df_name == 'df_Battery':
+                df_new_rows = state.battery_features(df_keys)
+            else:
+                df_new_rows = FeatureEngineer(state.events(df_name, df_keys=df_keys), df_name, \
+                                              instrumentation=self.instrumentation).engineer()
+            self._replace_rows(df_name, df_new_rows, df_keys=df_keys)
+
+        adv_name = df_name + '_advanced'
+        if adv_name in self.feature_dfs_forflmat:
+            add_centrality_chars = self.add_centrality_chars and df_name == 'df_BluetoothProximity'
+            if add_centrality_chars:
+                df_events = state.events(df_name)
+            else:
+                df_events = state.events(df_name, participants=participants)
+            df_new_rows = FeatureEngineer(df_events, df_name, advanced=True, \
+                                          add_centrality_chars=add_centrality_chars, \
+                                          centrality_window_days=self.centrality_window_days if add_centrality_chars else None, \
+                                          instrumentation=self.instrumentation, encoder=self.encoder)\
+                                          .engineer().drop(['index', 'cnt'], axis=1)
+            if add_centrality_chars:
+                self.feature_dfs_forflmat[adv_name] = df_new_rows
+            else:
+                df_new_rows = df_new_rows[df_new_rows['participantID'].isin(participants)]
+                self._replace_rows(adv_name, df_new_rows, participants=participants)
+
+    @instrumented('feature_label_mat')
+    def update_feature_label_mat(self, new_feature_dfs, df_new_labels=None):
+        '''
+        INPUT: dict of df_name --> DataFrame, DataFrame
+            - new_feature_dfs: newly arrived raw log rows, keyed like feature_dfs (e.g., 'df_SMSLog'),
+                               in the same format as the CSV files
+            - df_new_labels: newly arrived labels (in the format of create_poss_labels), if any
+        OUTPUT: None
+
+        Incremental alternative to re-running create_feature_label_mat when new days of logs arrive.
+        Requires state_dir, and create_feature_label_mat to have been run first; call before
+        create_cv_pipeline. Folds the new rows into incremental_state,
+        recomputes only the affected feature rows (see _update_blocks), and rebuilds only the
+        affected participants' rows of feature_label_mat.
+        '''
+        if self.incremental_state is None:
+            raise ValueError("update_feature_label_mat requires ModelTester to be created with state_dir")
+
+        affected_partics = set()
+        for df_name, df in new_feature_dfs.items():
+            with self.instrumentation.stage('ingest ' + df_name, df):
+                df = self.encoder.encode(self._limit_dates_df(df_name, df))
+                df_keys, participants = self.incremental_state.ingest(df_name, df)
+            with self.instrumentation.stage('_update_blocks ' + df_name, df_keys):
+                self._update_blocks(df_name, df_keys, participants)
+            affected_partics |= participants
+        self.incremental_state.save()
+
+        if df_new_labels is not None:
+            df_new_labels = self.encoder.encode(df_new_labels)
+            self.df_labels = pd.concat([self.df_labels, df_new_labels], ignore_index=True).drop_duplicates()
+            affected_partics |= set(df_new_labels['participantID'])
+        self.encoder.save()
+        self._add_rolling_blocks()
+
+        df_unaffected = self.feature_label_mat[~self.feature_label_mat['participantID'].isin(affected_partics)]
+        self.feature_label_mat = self._join_features(self.df_labels[self.df_labels['participantID'].isin(affected_partics)])
+        self._finish_feature_label_mat()
+        self.feature_label_mat = pd.concat([df_unaffected, self.feature_label_mat], ignore_index=True)
+        print "ModelTester: Updated feature-label matrix rows for", len(affected_partics), "participants"
+
+    @instrumented('feature_label_mat')
     def create_cv_pipeline(self, n_folds):
         '''
         INPUT: int
         OUTPUT: None
 
         Divides feature-label matrix into n_folds folds, saving each to, respectively,
-        X_train_folds, X_test_folds, y_all_train_folds, and y_all_test_folds.
-        Scales features if self.reduce_dimensions set to True.
+        X_train_folds, X_test_folds, y_all_train_folds, and y_all_test_folds. These are FoldArrays
+        over a single copy of the matrix, so each fold is only materialized when accessed.
+        Features are left unscaled; if self.reduce_dimensions, each fold is scaled on its own
+        training rows (see _set_cv_folds).
         To be used in n_folds-fold cross-validation.
         '''
 
@@ -228,68 +974,120 @@ class ModelTester(object):
         drop_from_X = self.poss_labels + ['participantID', 'date']
         self.features_used = self.feature_label_mat.drop(drop_from_X, axis=1).columns.values
         self.feature_label_mat.sort('participantID', inplace=True)  # Necessary so doesn't "learn" the participants
+        self.fold_preprocessors = {}
 
-        if self.reduce_dimensions:
-            scaler = StandardScaler()
-            self.feature_label_mat[self.features_used] = scaler.fit_transform(self.feature_label_mat[self.features_used])
-
-        X = self.feature_label_mat.drop(drop_from_X, axis=1).values
-        y_all = self.feature_label_mat[self.poss_labels].values
+        X = np.ascontiguousarray(self.feature_label_mat.drop(drop_from_X, axis=1).values, dtype=float)
+        y_all = np.ascontiguousarray(self.feature_label_mat[self.poss_labels].values)
 
-        ''' 2. Defines folds and saves to lists'''
+        ''' 2. Defines folds as views over X and y_all (KFold without shuffling gives contiguous test
+               ranges, so test folds and edge train folds are slices; other train folds are indexed) '''
+        train_indexers, test_indexers = [], []
         for train_index, test_index in kf:
-            X_train, X_test = X[train_index], X[test_index]
-            y_all_train, y_all_test = y_all[train_index], y_all[test_index]
-            self.X_train_folds.append(X_train)
-            self.X_test_folds.append(X_test)
-            self.y_all_train_folds.append(y_all_train)
-            self.y_all_test_folds.append(y_all_test)
+            train_indexers.append(_as_indexer(train_index))
+            test_indexers.append(_as_indexer(test_index))
+        self.X_train_folds, self.X_test_folds = FoldArrays(X, train_indexers), FoldArrays(X, test_indexers)
+        self.y_all_train_folds, self.y_all_test_folds = FoldArrays(y_all, train_indexers), FoldArrays(y_all, test_indexers)
+        partic = self.feature_label_mat['participantID'].values
+        self.partic_train_folds, self.partic_test_folds = FoldArrays(partic, train_indexers), FoldArrays(partic, test_indexers)
         print "Cross-validation folds created"
 
-    def fit_score_models(self, models, energy_kept=0.9):
+    @instrumented('feature_label_mat')
+    def _set_cv_folds(self, energy_kept):
+        '''
+        INPUT: float
+        OUTPUT: None
+
+        Points _cv_folds at this ModelTester's folds, for _fit_score_job. If the folds need
+        preprocessing (per-fold median imputation and/or, if reduce_dimensions, scaling and PCA),
+        each fold's preprocessing is fitted once (see _preprocess_fold), the folds in parallel, and
+        kept in fold_preprocessors, so every model and label (and later calls) share it. Only the
+        fitted medians, scalers and PCAs are kept; each job transforms its own fold, so there is
+        never more than one preprocessed copy of a fold per running job.
+        '''
+        global _cv_folds
+        _cv_folds = (self.X_train_folds, self.X_test_folds, self.y_all_train_folds, self.y_all_test_folds, \
+                     self.partic_train_folds, self.partic_test_folds, None)
+        median_fill_col_nums = [list(self.features_used).index(col) for col in self.median_fill_cols]
+        if not median_fill_col_nums and not self.reduce_dimensions:
+            return
+
+        key = (energy_kept, self.pca_solver)
+        if key not in self.fold_preprocessors:
+            jobs = [(i, median_fill_col_nums, self.reduce_dimensions, energy_kept, self.pca_solver) \
+                    for i in xrange(self.n_folds)]
+            fold_preprocessors = []
+            for preprocessor, records in self._map(_preprocess_fold, jobs):
+                fold_preprocessors.append(preprocessor)
+                self.instrumentation.add(records)
+            self.fold_preprocessors[key] = fold_preprocessors
+        _cv_folds = _cv_folds[:-1] + (self.fold_preprocessors[key],)
+
+    def fit_score_models(self, models, energy_kept=0.9, staged=False, holdout_fraction=None, \
+                         early_stopping_rounds=None):
         '''
-        INPUT: dict of model --> string (e.g.,: {rfr: 'Random Forest Regressor', ...})
+        INPUT: dict of model --> string (e.g.,: {rfr: 'Random Forest Regressor', ...}), float, bool,
+               float, int
+            - staged: for models with staged_predict (AdaBoost, GradientBoosting), whether to score
+                      every number of estimators up to n_estimators from a single fit per fold
+            - holdout_fraction: if staged, share of each training fold held out to choose the
+                                number of estimators, so the reported scores aren't tuned on the test folds
+            - early_stopping_rounds: if holdout_fraction, stops GradientBoosting fits once the
+                                     holdout R^2 hasn't improved for this many iterations
         OUTPUT: None
 
         Fits and scores inputted models, printing out k-fold scores and average score.
         Reduces dimensions if self.reduce_dimensions, keeping energy_kept proportion of energy (or # of features).
-        Saves feature importances in feature_importances.
+        Saves feature importances in feature_importances. Records the preprocessing, fit and score
+        time of every (model, label, fold) in instrumentation.
+        If staged, saves to staged_results[(description, label)] the mean test R^2 after each
+        iteration ('mean_curve'), the number of estimators that maximizes it ('best_n_estimators')
+        and, with holdout_fraction, the number chosen on each fold's holdout ('holdout_n_estimators').
         '''
 
         '''
         INPUT: Float
         OUTPUT: None
-        Scales, then uses PCA on self.feature_label_mat to reduce the number of features, preserving
-        energy_kept proportion of the original energy (variance).
+        Scales, then uses PCA on each fold's training rows to reduce the number of features, preserving
+        energy_kept proportion of the original energy (variance). Fitted once per fold (see
+        _set_cv_folds) and shared by every model and label.
         '''
 
         self.models = models    # Mostly to save for future reference
-        for model, descrip in models.iteritems():
+        model_descrips = list(models.iteritems())   # Fixes one order for dispatching and collecting results
+
+        ''' Every (model, label, fold) fit is an independent job with its own cloned estimator '''
+        self._set_cv_folds(energy_kept)
+        staged_options = (holdout_fraction, early_stopping_rounds) if staged else None
+        jobs = []
+        for model, descrip in model_descrips:
+            for poss_label_col_num, poss_label in enumerate(self.poss_labels):
+                for i in xrange(self.n_folds):
+                    jobs.append((clone(model), i, poss_label_col_num, self.reduce_dimensions, staged_options))
+        results = iter(self._map(_fit_score_job, jobs))
+
+        for model, descrip in model_descrips:
             mean_scores_by_label, mean_adj_r2_by_label = {}, {}
             for poss_label_col_num, poss_label in enumerate(self.poss_labels):
                 scores = np.zeros(self.n_folds)
+                fold_staged_results = []
                 for i in xrange(self.n_folds):
-                    X_train, X_test = self.X_train_folds[i], self.X_test_folds[i]
-                    y_train = self.y_all_train_folds[i][:, poss_label_col_num]
-
-                    # Reducing dimensions: fits on X_train, transforms X_train and X_test
-                    if self.reduce_dimensions:
-                        pca = PCA(n_components=energy_kept)
-                        pca.fit(X_train)
-                        X_train = pca.transform(X_train)
-                        X_test = pca.transform(X_test)
-
-                    model.fit(X_train, y_train)
-                    scores[i] = model.score(X_test, self.y_all_test_folds[i][:, poss_label_col_num])
+                    scores[i], feature_importances, staged_results, records = next(results)
+                    for record in records:
+                        record.update(model=descrip, label=poss_label, fold=i)
+                    self.instrumentation.add(records)
+                    if staged_results is not None:
+                        fold_staged_results.append(staged_results)
                 print "scores: ", scores
+                if fold_staged_results:
+                    self._save_staged_results(descrip, poss_label, fold_staged_results)
                 mean_scores_by_label[poss_label] = np.mean(scores)
                 samp_size = self.feature_label_mat.shape[0]
                 n_feat = len(self.features_used)
 
-                ''' Feature importances '''
-                if not self.reduce_dimensions:
-                    importances = np.array(zip(self.features_used, model.feature_importances_))
-                    descending_importance_indexes = np.argsort(model.feature_importances_)[::-1]
+                ''' Feature importances (from the last fold's fit; None for, e.g., Linear Regression) '''
+                if feature_importances is not None:
+                    importances = np.array(zip(self.features_used, feature_importances))
+                    descending_importance_indexes = np.argsort(feature_importances)[::-1]
                     self.feature_importances.append((descrip, poss_label, importances[descending_importance_indexes]))
 
             ''' R^2, Adjusted R^2 '''
@@ -300,3 +1098,186 @@ class ModelTester(object):
                 print label, " R^2: ", score
             print "==================================================="
             print "\n"
+
+    def _save_staged_results(self, descrip, poss_label, fold_staged_results):
+        '''
+        INPUT: string, string, list of dicts
+        OUTPUT: None
+
+        Averages the folds' staged test R^2 curves (see _fit_score_job) into staged_results and
+        prints the best number of estimators. Curves of fits stopped early are shorter; the mean
+        at each iteration is over the folds that reached it.
+        '''
+        n_iter = max(len(result['test_scores']) for result in fold_staged_results)
+        curves = np.full((len(fold_staged_results), n_iter), np.nan)
+        for i, result in enumerate(fold_staged_results):
+            curves[i, :len(result['test_scores'])] = result['test_scores']
+        mean_curve = np.nanmean(curves, axis=0)
+        best_n_estimators = int(np.argmax(mean_curve)) + 1
+        holdout_n_estimators = [result['holdout_best'] + 1 for result in fold_staged_results \
+                                if result['holdout_best'] is not None]
+        self.staged_results[(descrip, poss_label)] = {'mean_curve': mean_curve, 'best_n_estimators': best_n_estimators, \
+                                                      'holdout_n_estimators': holdout_n_estimators}
+        print "best n_estimators on test folds: %d (mean R^2 %.4f; %.4f at %d)" % \
+              (best_n_estimators, mean_curve[best_n_estimators - 1], mean_curve[-1], n_iter)
+        if holdout_n_estimators:
+            print "n_estimators chosen on holdouts: ", holdout_n_estimators
+
+    @instrumented('feature_label_mat')
+    def halving_search(self, model, param_grid, poss_label=None, eta=3, results_path=None, energy_kept=0.9):
+        '''
+        INPUT: model, dict, string, int, string, float
+            - model: estimator whose parameters to tune (e.g., GradientBoostingRegressor(n_estimators=1000))
+            - param_grid: dict of parameter --> list of values, as for sklearn's GridSearchCV
+            - poss_label: label to score on; defaults to the first of poss_labels
+            - eta: each rung keeps the best 1/eta of the candidates and gives them eta times the resources
+            - results_path: if set, JSON file in which every fold's score is saved as soon as it is
+                            computed, so an interrupted search picks up where it left off
+        OUTPUT: list of (dict, float)
+
+        Successive-halving search over param_grid on the folds built by create_cv_pipeline. The
+        first rung scores every candidate cheaply, on the first folds and (for models with
+        n_estimators) with a fraction of the trees; each later rung keeps the best 1/eta, until
+        the last eta or so candidates are scored with all folds and all trees. Every (candidate,
+        fold) fit is an independent job, run in a pool of n_jobs processes when n_jobs > 1.
+        Saved scores are only reused if the model, label, folds and feature-label matrix are
+        unchanged. Returns the last rung's (parameters, mean R^2), best first.
+        '''
+        poss_label = poss_label or self.poss_labels[0]
+        poss_label_col_num = self.poss_labels.index(poss_label)
+        self._set_cv_folds(energy_kept)
+        has_n_estimators = 'n_estimators' in model.get_params()
+        candidates = list(ParameterGrid(param_grid))
+        n_rungs = max(1, int(math.ceil(math.log(len(candidates)) / math.log(eta) - 1e-9)))
+
+        ''' Loads saved scores, keyed by (parameters, n_estimators, fold) '''
+        setup = {'model': repr(model), 'label': poss_label, 'n_folds': self.n_folds, \
+                 'reduce_dimensions': self.reduce_dimensions, 'energy_kept': energy_kept, 'pca_solver': self.pca_solver, \
+                 'data': fingerprint(self.feature_label_mat)}
+        saved = {'setup': setup, 'scores': []}
+        if results_path and os.path.exists(results_path):
+            with open(results_path) as f:
+                previous = json.load(f)
+            if previous['setup'] == json.loads(json.dumps(setup)):
+                saved = previous
+                print "ModelTester: Resuming search with", len(saved['scores']), "saved fold scores"
+        fold_scores = dict(((json.dumps(entry['params'], sort_keys=True), entry['n_estimators'], entry['fold']), \
+                            entry['score']) for entry in saved['scores'])
+
+        for rung in xrange(n_rungs):
+            resource = float(eta) ** (rung - n_rungs + 1)   # Share of folds and trees used in this rung
+            n_folds = max(1, min(self.n_folds, int(math.ceil(self.n_folds * resource - 1e-9))))
+            jobs, job_keys, rung_keys = [], [], []
+            for params in candidates:
+                n_estimators = None
+                if has_n_estimators:
+                    full_n_estimators = params.get('n_estimators', model.get_params()['n_estimators'])
+                    n_estimators = max(1, int(round(full_n_estimators * resource)))
+                candidate_keys = []
+                for i in xrange(n_folds):
+                    key = (json.dumps(params, sort_keys=True), n_estimators, i)
+                    candidate_keys.append(key)
+                    if key not in fold_scores and key not in job_keys:
+                        candidate = clone(model).set_params(**params)
+                        if has_n_estimators:
+                            candidate.set_params(n_estimators=n_estimators)
+                        jobs.append((candidate, i, poss_label_col_num, self.reduce_dimensions, None))
+                        job_keys.append(key)
+                rung_keys.append(candidate_keys)
+
+            ''' Runs the rung's jobs in batches, saving the scores after each '''
+            batch_size = 4 * max(1, self.n_jobs)
+            for start in xrange(0, len(jobs), batch_size):
+                results = self._map(_fit_score_job, jobs[start:start + batch_size])
+                for key, (score, _, _, records) in zip(job_keys[start:start + batch_size], results):
+                    fold_scores[key] = score
+                    saved['scores'].append({'params': json.loads(key[0]), 'n_estimators': key[1], \
+                                            'fold': key[2], 'score': score})
+                    for record in records:
+                        record.update(model='halving_search ' + key[0], label=poss_label, fold=key[2])
+                    self.instrumentation.add(records)
+                if results_path:
+                    with open(results_path, 'w') as f:
+                        json.dump(saved, f)
+
+            ranked = sorted(zip(candidates, [np.mean([fold_scores[key] for key in keys]) for keys in rung_keys]), \
+                            key=lambda candidate_score: -candidate_score[1])
+            print "Rung %d: %d candidates, %d folds%s; best R^2 %.4f with %s" % \
+                  (rung, len(candidates), n_folds, ", %.3g%% of estimators" % (100 * resource) if has_n_estimators else "", \
+                   ranked[0][1], ranked[0][0])
+            candidates = [params for params, _ in ranked[:max(1, int(math.ceil(len(ranked) / float(eta))))]]
+        return ranked
+
+    @instrumented('feature_label_mat')
+    def export_predictor(self, model, path, energy_kept=0.9):
+        '''
+        INPUT: model, string, float
+        OUTPUT: None
+
+        Fits a clone of model on the whole feature-label matrix for each label in poss_labels and
+        saves to path everything MoodPredictor needs to score new days: the fitted models,
+        features_used, and per-participant profiles (top-10 contact buckets, whole-study per-day
+        means and centrality, and feature medians).
+        Call after create_feature_label_mat. If reduce_dimensions, the scaler and PCA are fitted
+        on the whole matrix and saved with the models.
+        Raises ValueError if the matrix has features MoodPredictor can't compute from a single
+        day's logs (those added by rolling_windows, centrality_window_days or battery_stats).
+        '''
+        drop_from_X = self.poss_labels + ['participantID', 'date']
+        features_used = self.feature_label_mat.drop(drop_from_X, axis=1).columns.values
+
+        unsupported_cols = set([col + '_window' for col in CENTRALITY_COLS] + BATTERY_EXTRA_COLS)
+        for block_name, df_block in self.feature_dfs_forflmat.items():
+            if block_name.endswith('_rolling'):
+                unsupported_cols.update(df_block.columns)
+        unsupported = [col for col in features_used if col.replace('_demedianed', '') in unsupported_cols]
+        if unsupported:
+            raise ValueError("MoodPredictor can't compute " + ", ".join(unsupported) + "; export a predictor " + \
+                             "from a ModelTester without rolling_windows, centrality_window_days and battery_stats")
+
+        X = np.ascontiguousarray(self.feature_label_mat[features_used].values, dtype=float)
+        if self.median_fill_cols:   # Left missing for per-fold imputation; here every row is a training row
+            partic = self.feature_label_mat['participantID'].values
+            median_fill_col_nums = [list(features_used).index(col) for col in self.median_fill_cols]
+            X, _ = _impute_fold_medians(X, X[:0], partic, partic[:0], median_fill_col_nums)
+        scaler, pca = None, None
+        if self.reduce_dimensions:
+            scaler = StandardScaler().fit(X)
+            pca = _fit_pca(scaler.transform(X), energy_kept, self.pca_solver)
+            X = pca.transform(scaler.transform(X))
+        fitted_models = {}
+        for poss_label in self.poss_labels:
+            fitted_models[poss_label] = clone(model).fit(X, self.feature_label_mat[poss_label].values)
+
+        ''' Per-participant profiles, keyed by the original (decoded) IDs and hashes '''
+        profiles = {}
+        decode_partic = lambda partic: self.encoder.values('participant', [partic])[0]
+        base_cols = [col for col in features_used if not col.endswith('_demedianed') and \
+                     col not in ('day_of_week', 'weekend')]
+        for partic, medians in self.feature_label_mat.groupby('participantID')[base_cols].median().iterrows():
+            profiles.setdefault(decode_partic(partic), new_profile())['medians'] = dict(medians)
+        for df_name in ['df_SMSLog', 'df_CallLog', 'df_BluetoothProximity']:
+            adv_name = df_name + '_advanced'
+            if adv_name not in self.feature_dfs_forflmat:
+                continue
+            df_adv = self.feature_dfs_forflmat[adv_name]
+            const_cols = [col for col in df_adv.columns if col.endswith('_perday') or col in CENTRALITY_COLS]
+            for partic, values in df_adv.groupby('participantID')[const_cols].first().iterrows():
+                profiles.setdefault(decode_partic(partic), new_profile())['values'].update(dict(values))
+
+            if self.incremental_state and df_name in self.incremental_state.tables:
+                df_events = self.incremental_state.events(df_name)
+            else:
+                df_events = self.feature_dfs[df_name]
+            fe = FeatureEngineer(df_events, df_name, advanced=True, encoder=self.encoder)
+            df_contacts = fe.ranked_contacts()
+            df_contacts['contact'] = self.encoder.values(NAMESPACES[fe.target], df_contacts[fe.target])
+            for partic, df_partic in df_contacts.groupby('participantID'):
+                profiles.setdefault(decode_partic(partic), new_profile())['contacts'][fe.nickname] = \
+                                                            dict(zip(df_partic['contact'], df_partic['bucket']))
+
+        bundle = {'models': fitted_models, 'poss_labels': self.poss_labels, 'features_used': list(features_used), \
+                  'partic_median_cols': self.partic_median_cols, 'profiles': profiles, 'scaler': scaler, \
+                  'pca': pca, 'Fri_weekend': self.Fri_weekend}
+        joblib.dump(bundle, path)
+        print "ModelTester: Predictor saved to", path
@@ -0,0 +1,73 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import warnings
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import synthetic_data
+from data_cache import FrameCache, fingerprint
+from test_models import ModelTester
+
+
+class FingerprintTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_round_trip_keeps_fingerprint(self):
+        '''
+        A frame loaded from FrameCache (column names back from JSON as unicode) hashes like the
+        frame that was saved (str column names).
+        '''
+        df = pd.DataFrame({'participantID': ['a', 'b', 'a'], 'cnt': [1, 2, 3]}, columns=['participantID', 'cnt'])
+        cache = FrameCache(self.cache_dir)
+        cache.save('key', df)
+        self.assertEqual(fingerprint(cache.load('key')), fingerprint(df))
+
+
+class FeatureCacheAfterFrameCacheTest(unittest.TestCase):
+    FILES = ['SMSLog.csv', 'CallLog.csv', 'BluetoothProximity.csv']
+
+    def setUp(self):
+        warnings.simplefilter('ignore')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp_dir, 'data') + '/'
+        synthetic_data.generate(self.data_dir, n_participants=6, n_days=6)
+        self.cache_dir = os.path.join(self.tmp_dir, 'frames')
+        self.feature_cache_dir = os.path.join(self.tmp_dir, 'features')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _build(self):
+        mt = ModelTester(self.FILES, ['happy'], [], data_dir=self.data_dir, cache_dir=self.cache_dir, \
+                         feature_cache_dir=self.feature_cache_dir)
+        mt.create_feature_label_mat()
+        return mt
+
+    def test_feature_cache_hits_on_frames_from_frame_cache(self):
+        '''
+        The first run fills the frame cache and the feature cache; the second reads its frames
+        from the frame cache and must find every feature family in the feature cache.
+        '''
+        first = self._build()
+        frame_entries = sorted(os.listdir(self.cache_dir))
+        feature_entries = sorted(os.listdir(self.feature_cache_dir))
+
+        second = self._build()
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), frame_entries)
+        self.assertEqual(sorted(os.listdir(self.feature_cache_dir)), feature_entries)
+        cache_loads = [record for record in second.instrumentation.records if record['stage'].startswith('load cached ')]
+        self.assertEqual(len(cache_loads), len(feature_entries))
+        self.assertTrue(all(record['rows_out'] is not None for record in cache_loads))
+        self.assertTrue(second.feature_label_mat.equals(first.feature_label_mat))
+
+
+if __name__ == '__main__':
+    unittest.main()
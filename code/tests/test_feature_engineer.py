@@ -0,0 +1,51 @@
+import os
+import sys
+import unittest
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from feature_engineer import FeatureEngineer
+
+
+class BatteryStatsTest(unittest.TestCase):
+    def _readings(self, times, levels, plugged):
+        '''
+        INPUT: list of strings, list of ints, list of ints
+        OUTPUT: DataFrame
+
+        Returns one participant's battery readings on 2010-11-01, as cleaned by ModelTester.
+        '''
+        n = len(times)
+        return pd.DataFrame({'participantID': ['fa10-01-001'] * n, 'date': pd.to_datetime(['2010-11-01'] * n), \
+                             'local_time': pd.to_datetime(times), 'level': levels, 'plugged': plugged, \
+                             'temperature': [300] * n, 'voltage': [4000] * n})
+
+    def _engineer(self, df):
+        return FeatureEngineer(df, 'df_Battery', battery_stats=['hours_plugged', 'discharge_rate']).engineer()
+
+    def test_discharge_rate_leaves_out_plug_in(self):
+        '''
+        Loses 20 points over the 2 unplugged hours, then is plugged in (the level rises 20); the
+        interval ending in the plug-in is not part of the discharge.
+        '''
+        df = self._readings(['2010-11-01 08:00', '2010-11-01 09:00', '2010-11-01 10:00', \
+                             '2010-11-01 11:00', '2010-11-01 12:00'], \
+                            [90, 80, 70, 90, 100], [0, 0, 0, 1, 1])
+        row = self._engineer(df).iloc[0]
+        self.assertAlmostEqual(row['discharge_rate'], 10.)
+        self.assertAlmostEqual(row['hours_plugged'], 1.)
+
+    def test_discharge_rate_missing_without_unplugged_interval(self):
+        '''
+        Unplugged only for the reading just before the plug-in: no discharge interval at all.
+        '''
+        df = self._readings(['2010-11-01 08:00', '2010-11-01 09:00', '2010-11-01 10:00'], \
+                            [50, 60, 70], [0, 1, 1])
+        row = self._engineer(df).iloc[0]
+        self.assertTrue(pd.isnull(row['discharge_rate']))
+        self.assertAlmostEqual(row['hours_plugged'], 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()